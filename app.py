@@ -17,9 +17,25 @@ import os
 import time
 import hashlib
 import re
+import functools
+import importlib.util
+import itertools
+import multiprocessing
+import pickle
+import sys
+import threading
+import socket
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
 import io
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+
+import sheet_conversion
+from sheet_conversion import to_numeric_matrix
 
 # 页面配置 - 修复重复配置问题
 if "page_configured" not in st.session_state:
@@ -35,22 +51,87 @@ if "page_configured" not in st.session_state:
 class ConfigManager:
     """配置管理器"""
     
+    # MongoClient参数对应的secrets键和环境变量
+    MONGODB_CLIENT_SETTINGS = {
+        'max_pool_size': 'MONGODB_MAX_POOL_SIZE',
+        'min_pool_size': 'MONGODB_MIN_POOL_SIZE',
+        'max_idle_time_ms': 'MONGODB_MAX_IDLE_TIME_MS',
+        'compressors': 'MONGODB_COMPRESSORS',
+        'zlib_compression_level': 'MONGODB_ZLIB_COMPRESSION_LEVEL',
+        'read_preference': 'MONGODB_READ_PREFERENCE',
+        'write_concern': 'MONGODB_WRITE_CONCERN',
+        'journal': 'MONGODB_JOURNAL',
+        'wtimeout_ms': 'MONGODB_WTIMEOUT_MS'
+    }
+    
     @staticmethod
     def get_mongodb_config():
-        """获取MongoDB配置"""
+        """获取MongoDB配置，client_options为连接池、压缩、读偏好和写关注等MongoClient参数
+        
+        未配置secrets时使用环境变量；连接参数无效时抛出ValueError，不回退到默认连接
+        """
+        mongodb_secrets = None
         try:
             if hasattr(st, 'secrets') and 'mongodb' in st.secrets:
-                return {
-                    'uri': st.secrets["mongodb"]["uri"],
-                    'database_name': st.secrets["mongodb"]["database_name"]
-                }
+                mongodb_secrets = st.secrets["mongodb"]
         except Exception:
             pass
         
-        return {
-            'uri': os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'),
-            'database_name': os.getenv('DATABASE_NAME', 'store_reports')
-        }
+        if mongodb_secrets is not None:
+            config = {
+                'uri': mongodb_secrets["uri"],
+                'database_name': mongodb_secrets["database_name"]
+            }
+            settings = mongodb_secrets
+        else:
+            config = {
+                'uri': os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'),
+                'database_name': os.getenv('DATABASE_NAME', 'store_reports')
+            }
+            settings = {
+                key: os.environ[env_name]
+                for key, env_name in ConfigManager.MONGODB_CLIENT_SETTINGS.items()
+                if env_name in os.environ
+            }
+        
+        try:
+            config['client_options'] = ConfigManager._build_client_options(settings)
+        except ValueError as e:
+            raise ValueError(f"MongoDB连接参数配置无效: {e}") from e
+        return config
+    
+    @staticmethod
+    def _build_client_options(settings) -> Dict:
+        """将配置转换为MongoClient关键字参数，未配置的项不传递，沿用URI参数或驱动默认值
+        
+        compressors未配置时不启用线路压缩，配置后按顺序与服务器协商，本机未安装的压缩库会被跳过；
+        write_concern可为数字或majority
+        """
+        options = {}
+        for key, option in (('max_pool_size', 'maxPoolSize'), ('min_pool_size', 'minPoolSize'), ('max_idle_time_ms', 'maxIdleTimeMS')):
+            if settings.get(key) not in (None, ''):
+                options[option] = int(settings[key])
+        if settings.get('read_preference'):
+            options['readPreference'] = str(settings['read_preference'])
+        
+        compressors = settings.get('compressors') or []
+        if isinstance(compressors, str):
+            compressors = compressors.split(',')
+        compressors = DatabaseManager.supported_compressors(compressors)
+        if compressors:
+            options['compressors'] = ','.join(compressors)
+            if 'zlib' in compressors and settings.get('zlib_compression_level') not in (None, ''):
+                options['zlibCompressionLevel'] = int(settings['zlib_compression_level'])
+        
+        write_concern = str(settings.get('write_concern', '')).strip()
+        if write_concern:
+            options['w'] = int(write_concern) if write_concern.isdigit() else write_concern
+        if settings.get('journal') not in (None, ''):
+            journal = settings['journal']
+            options['journal'] = journal if isinstance(journal, bool) else str(journal).lower() in ('1', 'true', 'yes')
+        if settings.get('wtimeout_ms') not in (None, ''):
+            options['wTimeoutMS'] = int(settings['wtimeout_ms'])
+        return options
     
     @staticmethod
     def get_admin_password():
@@ -61,23 +142,238 @@ class ConfigManager:
         except Exception:
             pass
         return os.getenv('ADMIN_PASSWORD', 'admin123')
+    
+    @staticmethod
+    def get_report_storage_format():
+        """获取报表原始数据存储格式：columnar（列式压缩）或 rows（逐行字典，旧格式）"""
+        try:
+            if hasattr(st, 'secrets') and 'storage' in st.secrets:
+                return st.secrets["storage"].get("raw_data_format", "columnar")
+        except Exception:
+            pass
+        return os.getenv('REPORT_STORAGE_FORMAT', 'columnar')
+    
+    @staticmethod
+    def get_cache_config():
+        """获取缓存配置：查询页缓存最大条目数和最大占用内存（MB），登录缓存有效期（秒）"""
+        try:
+            if hasattr(st, 'secrets') and 'cache' in st.secrets:
+                return {
+                    'max_entries': int(st.secrets["cache"].get("max_entries", 512)),
+                    'max_mb': int(st.secrets["cache"].get("max_mb", 256)),
+                    'login_ttl': int(st.secrets["cache"].get("login_ttl_seconds", 300))
+                }
+        except Exception:
+            pass
+        return {
+            'max_entries': int(os.getenv('REPORT_CACHE_MAX_ENTRIES', '512')),
+            'max_mb': int(os.getenv('REPORT_CACHE_MAX_MB', '256')),
+            'login_ttl': int(os.getenv('LOGIN_CACHE_TTL_SECONDS', '300'))
+        }
+
+# 可选依赖：xlsxwriter用于生成下载的Excel文件，未安装时使用openpyxl
+try:
+    import xlsxwriter
+    XLSXWRITER_AVAILABLE = True
+except ImportError:
+    XLSXWRITER_AVAILABLE = False
 
 # 数据库管理
 try:
     import pymongo
-    from pymongo import MongoClient
+    from pymongo import MongoClient, InsertOne, ReplaceOne, UpdateOne, monitoring
+    from pymongo.errors import BulkWriteError
+    from bson import Binary, ObjectId
     PYMONGO_AVAILABLE = True
 except ImportError:
     PYMONGO_AVAILABLE = False
 
+# 连接诊断监听器同时监听命令和连接池事件，未安装pymongo时退化为普通类
+MONITOR_BASES = (monitoring.CommandListener, monitoring.ConnectionPoolListener) if PYMONGO_AVAILABLE else (object,)
+
+class ConnectionMonitor(*MONITOR_BASES):
+    """通过pymongo监听器收集连接池借出、等待时间和各命令耗时，供管理员诊断页面使用
+    
+    回调在驱动线程中同步执行，只做计数和追加耗时样本；每类样本只保留最近SAMPLE_SIZE个
+    """
+    
+    SAMPLE_SIZE = 1000
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        # pymongo 4.7之前的事件没有duration，按线程记录借出开始时间
+        self._checkout_start = threading.local()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self.pool = {
+                'connections_created': 0,
+                'connections_closed': 0,
+                'checkouts': 0,
+                'checkout_failures': 0,
+                'checked_out': 0,
+                'max_checked_out': 0,
+                'pool_cleared': 0
+            }
+            self.checkout_failure_reasons = {}
+            self.wait_times_ms = deque(maxlen=self.SAMPLE_SIZE)
+            self.commands = {}
+    
+    # 连接池事件
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool['pool_cleared'] += 1
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_created(self, event):
+        with self._lock:
+            self.pool['connections_created'] += 1
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        with self._lock:
+            self.pool['connections_closed'] += 1
+    
+    def connection_check_out_started(self, event):
+        self._checkout_start.value = time.perf_counter()
+    
+    def _checkout_duration_ms(self, event) -> Optional[float]:
+        duration = getattr(event, 'duration', None)
+        if duration is None:
+            started = getattr(self._checkout_start, 'value', None)
+            duration = time.perf_counter() - started if started is not None else None
+        return duration * 1000 if duration is not None else None
+    
+    def connection_check_out_failed(self, event):
+        duration_ms = self._checkout_duration_ms(event)
+        with self._lock:
+            self.pool['checkout_failures'] += 1
+            reason = str(event.reason)
+            self.checkout_failure_reasons[reason] = self.checkout_failure_reasons.get(reason, 0) + 1
+            if duration_ms is not None:
+                self.wait_times_ms.append(duration_ms)
+    
+    def connection_checked_out(self, event):
+        duration_ms = self._checkout_duration_ms(event)
+        with self._lock:
+            self.pool['checkouts'] += 1
+            self.pool['checked_out'] += 1
+            self.pool['max_checked_out'] = max(self.pool['max_checked_out'], self.pool['checked_out'])
+            if duration_ms is not None:
+                self.wait_times_ms.append(duration_ms)
+    
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.pool['checked_out'] = max(self.pool['checked_out'] - 1, 0)
+    
+    # 命令事件
+    def started(self, event):
+        pass
+    
+    def _record_command(self, event, failed: bool):
+        with self._lock:
+            stats = self.commands.get(event.command_name)
+            if stats is None:
+                stats = self.commands[event.command_name] = {
+                    'count': 0,
+                    'failed': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'samples': deque(maxlen=self.SAMPLE_SIZE)
+                }
+            duration_ms = event.duration_micros / 1000
+            stats['count'] += 1
+            stats['failed'] += failed
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['samples'].append(duration_ms)
+    
+    def succeeded(self, event):
+        self._record_command(event, failed=False)
+    
+    def failed(self, event):
+        self._record_command(event, failed=True)
+    
+    def snapshot(self) -> Dict:
+        """返回当前统计的副本：连接池计数、等待时间分位数和各命令耗时"""
+        with self._lock:
+            pool = dict(self.pool)
+            failure_reasons = dict(self.checkout_failure_reasons)
+            wait_times = np.array(self.wait_times_ms, dtype=float)
+            commands = [
+                (name, stats['count'], stats['failed'], stats['total_ms'], stats['max_ms'], np.array(stats['samples'], dtype=float))
+                for name, stats in self.commands.items()
+            ]
+        
+        pool['open_connections'] = pool['connections_created'] - pool['connections_closed']
+        if len(wait_times):
+            pool['wait_p50_ms'], pool['wait_p95_ms'] = np.percentile(wait_times, [50, 95])
+            pool['wait_max_ms'] = wait_times.max()
+        else:
+            pool['wait_p50_ms'] = pool['wait_p95_ms'] = pool['wait_max_ms'] = 0.0
+        
+        command_rows = []
+        for name, count, failed, total_ms, max_ms, samples in sorted(commands, key=lambda item: -item[3]):
+            p50, p95 = np.percentile(samples, [50, 95]) if len(samples) else (0.0, 0.0)
+            command_rows.append({
+                'command': name,
+                'count': count,
+                'failed': failed,
+                'avg_ms': total_ms / count,
+                'p50_ms': p50,
+                'p95_ms': p95,
+                'max_ms': max_ms,
+                'total_ms': total_ms
+            })
+        
+        return {
+            'started_at': self.started_at,
+            'pool': pool,
+            'checkout_failure_reasons': failure_reasons,
+            'commands': command_rows
+        }
+
 class DatabaseManager:
     """数据库管理器"""
     
+    # 压缩算法及其依赖的Python库，zlib为标准库始终可用
+    COMPRESSOR_MODULES = {'zstd': 'zstandard', 'snappy': 'snappy', 'zlib': 'zlib'}
+    
     def __init__(self):
         self.db = None
         self.client = None
+        self.client_options = {}
+        self.monitor = ConnectionMonitor()
+        self.index_report = None
+        # 因数据重复未能创建唯一索引的集合 -> 重复记录，以及创建索引时的错误
+        self.index_conflicts = {}
+        self.index_errors = []
+        self.unique_index_errors = []
         self._connect()
     
+    @staticmethod
+    def supported_compressors(compressors: List[str]) -> List[str]:
+        """过滤出pymongo支持且本机已安装依赖库的压缩算法，保持配置中的优先顺序"""
+        supported = []
+        for compressor in compressors:
+            compressor = str(compressor).strip().lower()
+            module_name = DatabaseManager.COMPRESSOR_MODULES.get(compressor)
+            if module_name and compressor not in supported and importlib.util.find_spec(module_name) is not None:
+                supported.append(compressor)
+        return supported
+    
     def _connect(self):
         """建立数据库连接"""
         if not PYMONGO_AVAILABLE:
@@ -86,7 +382,13 @@ class DatabaseManager:
             
         try:
             config = ConfigManager.get_mongodb_config()
-            self.client = MongoClient(config['uri'], serverSelectionTimeoutMS=5000)
+            self.client_options = config['client_options']
+            self.client = MongoClient(
+                config['uri'],
+                serverSelectionTimeoutMS=5000,
+                event_listeners=[self.monitor],
+                **self.client_options
+            )
             self.db = self.client[config['database_name']]
             
             # 测试连接
@@ -105,17 +407,216 @@ class DatabaseManager:
             self.db = None
             self.client = None
     
+    # 索引计划：集合 -> [(索引键, 是否唯一)]，启动时按计划创建并与$indexStats比对
+    INDEX_PLAN = {
+        'stores': [
+            ([("store_code", 1)], False),
+            ([("store_name", 1)], False),
+            ([("normalized_name", 1)], False),
+            ([("aliases", 1)], False)
+        ],
+        'permissions': [
+            ([("query_code", 1)], True)
+        ],
+        'reports': [
+            ([("store_id", 1), ("report_month", -1)], True),
+            ([("report_month", 1)], False)
+        ],
+        'report_summaries': [
+            ([("store_id", 1), ("report_month", -1)], True)
+        ]
+    }
+    
+    @staticmethod
+    def index_name(keys: List[Tuple[str, int]]) -> str:
+        """与pymongo默认规则一致的索引名称"""
+        return '_'.join(f"{field}_{direction}" for field, direction in keys)
+    
     def _create_indexes(self):
-        """创建索引"""
+        """按索引计划创建索引，并检查缺失和未使用的索引"""
         if self.db is None:
             return
-            
+        
         try:
-            self.db['stores'].create_index([("store_code", 1)], background=True)
-            self.db['permissions'].create_index([("query_code", 1)], background=True)
-            self.db['reports'].create_index([("store_id", 1), ("report_month", -1)], background=True)
+            self._backfill_store_normalized_names()
         except Exception:
             pass
+        
+        self.index_errors = []
+        for collection_name, indexes in self.INDEX_PLAN.items():
+            for keys, unique in indexes:
+                if unique:
+                    continue
+                try:
+                    self.db[collection_name].create_index(keys, background=True)
+                except Exception as e:
+                    self.index_errors.append(f"{collection_name}.{self.index_name(keys)}: {e}")
+        self.ensure_unique_indexes()
+    
+    def ensure_unique_indexes(self):
+        """按索引计划创建唯一索引并重新检查索引；存在重复数据的集合记入index_conflicts，不创建唯一索引"""
+        self.unique_index_errors = []
+        for collection_name, indexes in self.INDEX_PLAN.items():
+            for keys, unique in indexes:
+                if not unique:
+                    continue
+                try:
+                    self._ensure_unique_index(collection_name, keys)
+                except Exception as e:
+                    self.unique_index_errors.append(f"{collection_name}.{self.index_name(keys)}: {e}")
+        
+        self.index_report = self.check_indexes()
+    
+    def _backfill_store_normalized_names(self):
+        """为旧版本创建的门店补充normalized_name字段"""
+        stores = self.db['stores']
+        operations = [
+            UpdateOne({'_id': store['_id']}, {'$set': {'normalized_name': StoreModel.normalized_key(store.get('store_name', ''))}})
+            for store in stores.find({'normalized_name': {'$exists': False}}, {'store_name': 1})
+        ]
+        for start in range(0, len(operations), 1000):
+            stores.bulk_write(operations[start:start + 1000], ordered=False)
+    
+    def _ensure_unique_index(self, collection_name: str, keys: List[Tuple[str, int]]) -> bool:
+        """确保索引为唯一索引，返回唯一索引是否已存在或创建成功
+        
+        旧版本创建的是普通索引，已有数据可能重复：存在重复时不删除任何数据，保留（或创建）普通索引，
+        重复记录记入index_conflicts由管理员处理；没有重复时将旧的普通索引转换为唯一索引。
+        """
+        collection = self.db[collection_name]
+        name = self.index_name(keys)
+        existing_index = collection.index_information().get(name)
+        if existing_index and existing_index.get('unique'):
+            self.index_conflicts.pop(collection_name, None)
+            return True
+        
+        duplicates = self.find_duplicates(collection_name, keys)
+        if duplicates:
+            self.index_conflicts[collection_name] = {'index': name, 'keys': keys, 'duplicates': duplicates}
+            if not existing_index:
+                collection.create_index(keys, background=True)
+            return False
+        
+        if existing_index:
+            self._convert_to_unique_index(collection_name, keys)
+        else:
+            collection.create_index(keys, unique=True, background=True)
+        self.index_conflicts.pop(collection_name, None)
+        return True
+    
+    def _convert_to_unique_index(self, collection_name: str, keys: List[Tuple[str, int]]):
+        """将已有普通索引转换为唯一索引，转换失败时集合仍保留普通索引
+        
+        同一键模式不能同时存在普通索引和唯一索引：MongoDB 6.0+通过collMod原地转换，
+        旧版本只能删除后重建，重建失败（如期间写入了重复数据）时恢复普通索引后抛出异常。
+        """
+        collection = self.db[collection_name]
+        key_pattern = dict(keys)
+        try:
+            self.db.command('collMod', collection_name, index={'keyPattern': key_pattern, 'prepareUnique': True})
+        except Exception:
+            collection.drop_index(self.index_name(keys))
+            try:
+                collection.create_index(keys, unique=True, background=True)
+            except Exception:
+                collection.create_index(keys, background=True)
+                raise
+            return
+        
+        try:
+            self.db.command('collMod', collection_name, index={'keyPattern': key_pattern, 'unique': True})
+        except Exception:
+            # prepareUnique会拒绝新的重复写入，转换失败时撤销
+            self.db.command('collMod', collection_name, index={'keyPattern': key_pattern, 'prepareUnique': False})
+            raise
+    
+    def find_duplicates(self, collection_name: str, keys: List[Tuple[str, int]]) -> List[Dict]:
+        """查找索引键重复的文档，每组为{'key': 索引键取值, 'count': 文档数, 'ids': 按updated_at由新到旧排列的_id}"""
+        fields = [field for field, _ in keys]
+        duplicates = self.db[collection_name].aggregate([
+            {'$project': dict({field: 1 for field in fields}, updated_at=1)},
+            {'$sort': {'updated_at': -1}},
+            {'$group': {'_id': {field: f"${field}" for field in fields}, 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ], allowDiskUse=True)
+        return [{'key': duplicate['_id'], 'count': duplicate['count'], 'ids': duplicate['ids']} for duplicate in duplicates]
+    
+    def deduplicate(self, collection_name: str) -> int:
+        """去重迁移：由管理员确认后执行，删除index_conflicts中记录的重复文档（每组保留最近更新的一条）并创建唯一索引
+        
+        删除的报表同时删除其报表摘要并递增所在月份的数据版本，查询页找不到摘要时会从保留的报表重建；
+        删除重复权限时同时使对应查询编号的登录缓存失效。返回删除的文档数。
+        """
+        conflict = self.index_conflicts.get(collection_name)
+        if not conflict:
+            return 0
+        
+        # 重新查找重复记录，以执行时的数据为准
+        duplicates = self.find_duplicates(collection_name, conflict['keys'])
+        stale_ids = [stale_id for duplicate in duplicates for stale_id in duplicate['ids'][1:]]
+        deleted_count = 0
+        if stale_ids:
+            deleted_count = self.db[collection_name].delete_many({'_id': {'$in': stale_ids}}).deleted_count
+            if collection_name == 'reports':
+                self.db['report_summaries'].delete_many({'report_id': {'$in': stale_ids}})
+                for report_month in {duplicate['key']['report_month'] for duplicate in duplicates}:
+                    DataVersionManager.bump(self.db, report_month)
+            elif collection_name == 'permissions':
+                # 登录缓存中可能仍是已删除的重复权限解析出的门店
+                login_cache = get_login_cache()
+                for duplicate in duplicates:
+                    login_cache.invalidate(duplicate['key']['query_code'])
+        
+        self.ensure_unique_indexes()
+        return deleted_count
+    
+    def check_indexes(self) -> Dict:
+        """对照索引计划检查各集合索引：missing为计划中缺失的索引，unused为$indexStats中自统计开始以来未被使用的索引
+        
+        $indexStats的计数在mongod重启后清零，since为统计开始时间；不支持$indexStats时在errors中说明
+        """
+        report = {
+            'missing': [],
+            'unused': [],
+            'conflicts': [
+                {
+                    'collection': collection_name,
+                    'index': conflict['index'],
+                    'duplicate_keys': len(conflict['duplicates']),
+                    'extra_documents': sum(duplicate['count'] - 1 for duplicate in conflict['duplicates'])
+                }
+                for collection_name, conflict in self.index_conflicts.items()
+            ],
+            'errors': self.index_errors + self.unique_index_errors,
+            'checked_at': datetime.now()
+        }
+        if self.db is None:
+            return report
+        
+        for collection_name, indexes in self.INDEX_PLAN.items():
+            collection = self.db[collection_name]
+            try:
+                index_information = collection.index_information()
+                for keys, unique in indexes:
+                    name = self.index_name(keys)
+                    if name not in index_information or bool(index_information[name].get('unique')) != unique:
+                        report['missing'].append({'collection': collection_name, 'index': name, 'unique': unique})
+            except Exception as e:
+                report['errors'].append(f"{collection_name}: {e}")
+                continue
+            
+            try:
+                for stats in collection.aggregate([{'$indexStats': {}}]):
+                    if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                        report['unused'].append({
+                            'collection': collection_name,
+                            'index': stats['name'],
+                            'since': stats['accesses'].get('since')
+                        })
+            except Exception as e:
+                report['errors'].append(f"{collection_name} $indexStats: {e}")
+        
+        return report
     
     def get_database(self):
         """获取数据库实例"""
@@ -135,6 +636,127 @@ def clear_all_caches():
     st.cache_resource.clear()
     st.cache_data.clear()
 
+# 数据版本与缓存
+class DataVersionManager:
+    """数据版本管理：data_versions集合记录全局版本和每个月份的版本，上传后递增，缓存键包含版本号"""
+    
+    GLOBAL_KEY = 'global'
+    
+    @staticmethod
+    def month_key(report_month: str) -> str:
+        return f"month:{report_month}"
+    
+    @staticmethod
+    def get_versions(db) -> Dict[str, int]:
+        """一次读取所有版本号"""
+        return {doc['_id']: doc.get('version', 0) for doc in db['data_versions'].find({}, {'version': 1})}
+    
+    @staticmethod
+    def bump(db, report_month: str):
+        """递增指定月份和全局的数据版本"""
+        now = datetime.now()
+        for key in (DataVersionManager.month_key(report_month), DataVersionManager.GLOBAL_KEY):
+            db['data_versions'].update_one(
+                {'_id': key},
+                {'$inc': {'version': 1}, '$set': {'updated_at': now}},
+                upsert=True
+            )
+
+class BoundedCache:
+    """线程安全的LRU缓存，同时限制条目数和估算占用字节数，超出任一限制时淘汰最久未使用的条目
+    
+    设置ttl（秒）时条目超过有效期后视为未命中。缓存值在所有会话间共享，调用方不能修改取出的对象。
+    """
+    
+    _MISSING = object()
+    
+    def __init__(self, max_entries: int = 512, max_bytes: int = 256 * 1024 * 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def estimate_size(value) -> int:
+        """估算缓存值占用的字节数"""
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        try:
+            return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return sys.getsizeof(value)
+    
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, self._MISSING)
+            if entry is not self._MISSING and entry[2] is not None and entry[2] <= time.time():
+                self.total_bytes -= self._entries.pop(key)[1]
+                entry = self._MISSING
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, key, value, size: int = None):
+        size = self.estimate_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+    
+    def get_or_load(self, key, loader):
+        """命中时返回缓存值，否则调用loader加载并缓存（包括None结果）"""
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+    
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry[1]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+@st.cache_resource
+def get_report_cache():
+    config = ConfigManager.get_cache_config()
+    return BoundedCache(max_entries=config['max_entries'], max_bytes=config['max_mb'] * 1024 * 1024)
+
+@st.cache_resource
+def get_login_cache():
+    config = ConfigManager.get_cache_config()
+    return BoundedCache(max_entries=10000, max_bytes=16 * 1024 * 1024, ttl=config['login_ttl'])
+
 # 数据模型
 class StoreModel:
     """门店数据模型"""
@@ -150,11 +772,26 @@ class StoreModel:
             'region': kwargs.get('region', '未分类'),
             'manager': kwargs.get('manager', '待设置'),
             'aliases': kwargs.get('aliases', [store_name.strip()]),
+            'normalized_name': StoreModel.normalized_key(store_name),
             'created_at': kwargs.get('created_at', datetime.now()),
             'created_by': kwargs.get('created_by', 'system'),
             'status': kwargs.get('status', 'active')
         }
     
+    @staticmethod
+    def normalize_store_name(store_name: str) -> str:
+        """标准化门店名称"""
+        name = store_name.strip()
+        name = name.replace('犀牛百货', '').replace('门店', '').replace('店', '')
+        name = name.replace('(', '').replace(')', '').replace('（', '').replace('）', '')
+        name = ''.join(name.split())
+        return name
+    
+    @staticmethod
+    def normalized_key(store_name: str) -> str:
+        """门店的normalized_name字段取值：标准化名称的小写形式，按名称模糊匹配门店时使用"""
+        return StoreModel.normalize_store_name(store_name).lower()
+    
     @staticmethod
     def _generate_store_code(store_name: str) -> str:
         """生成门店代码"""
@@ -168,75 +805,119 @@ class StoreModel:
 class ReportModel:
     """报表数据模型"""
     
+    # raw_excel_data的列式存储格式标识，格式变化时递增版本号
+    COLUMNAR_FORMAT = 'columnar_v1'
+    
     @staticmethod
     def create_report_document(store_data: Dict, report_month: str, excel_data: List[Dict], headers: List[str], **kwargs) -> Dict:
-        """创建标准报表文档，保存完整表头"""
+        """创建标准报表文档，保存完整表头；storage_format为columnar时原始数据按列压缩存储"""
+        if kwargs.get('storage_format', 'rows') == 'columnar':
+            raw_excel_data = ReportModel.encode_columnar(excel_data, len(headers))
+        else:
+            raw_excel_data = excel_data
+        
         return {
             'store_id': store_data['_id'],
             'store_code': store_data['store_code'],
             'store_name': store_data['store_name'],
             'report_month': report_month,
             'sheet_name': kwargs.get('sheet_name', store_data['store_name']),
-            'raw_excel_data': excel_data,
+            'raw_excel_data': raw_excel_data,
             'table_headers': headers,  # 新增：保存表头信息
             'financial_data': kwargs.get('financial_data', {}),
-            'created_at': kwargs.get('created_at', datetime.now()),
+            'content_hash': kwargs.get('content_hash') or ReportModel.compute_content_hash(
+                excel_data, headers, kwargs.get('financial_data', {})
+            ),
+            'created_at': kwargs.get('created_at') or datetime.now(),
             'updated_at': datetime.now(),
             'uploaded_by': kwargs.get('uploaded_by', 'system')
         }
     
     @staticmethod
-    def dataframe_to_dict_list(df: pd.DataFrame) -> tuple[List[Dict], List[str]]:
-        """将DataFrame转换为字典列表，保留表头信息并修复#NAME?错误，处理空白表头"""
-        # 保存原始列名作为表头，处理Unnamed列，避免重复空白列名
-        headers = []
-        empty_count = 0
-        for col in df.columns:
-            col_str = str(col)
-            # 将Unnamed列名替换为空字符串
-            if col_str.startswith('Unnamed:') or col_str.startswith('Unnamed ') or ('unnamed' in col_str.lower()):
-                headers.append("")
-            else:
-                headers.append(col_str)
+    def create_summary_document(report: Dict) -> Dict:
+        """根据报表文档创建报表摘要，查询页看板只需读取摘要"""
+        financial_data = report.get('financial_data', {})
+        other_metrics = financial_data.get('other_metrics', {})
+        net_amount = financial_data.get('receivables', {}).get('net_amount')
         
-        # 处理重复的空白列名，为pandas创建唯一列名
-        unique_headers = []
-        empty_count = 0
-        for header in headers:
-            if header == "":
-                unique_headers.append(f"_empty_{empty_count}")
-                empty_count += 1
+        return {
+            'store_id': report['store_id'],
+            'store_code': report.get('store_code'),
+            'store_name': report.get('store_name'),
+            'report_month': report['report_month'],
+            'report_id': report['_id'],
+            'net_amount': net_amount,
+            'extraction_status': 'success' if net_amount is not None else 'failed',
+            'extraction_message': other_metrics.get('提取位置') if net_amount is not None
+                                  else other_metrics.get('提取失败原因', '未找到应收未收金额'),
+            'content_hash': report.get('content_hash'),
+            'updated_at': datetime.now()
+        }
+    
+    @staticmethod
+    def encode_columnar(excel_data: List[Dict], column_count: int) -> Dict:
+        """将逐行字典编码为列式结构，省去每行重复的col_N键名
+        
+        每列按内容选择编码：
+        - f8: 只含数字和空值，打包为小端float64二进制，空值记为NaN
+        - str: 只含文本，存为字符串表加int32编码二进制
+        - obj: 数字与文本混合，存为原值数组
+        """
+        columns = []
+        for col_idx in range(column_count):
+            col_key = f"col_{col_idx}"
+            values = [row.get(col_key, "") for row in excel_data]
+            value_types = set(map(type, values))
+            has_text = str in value_types and any(value != "" for value in values if type(value) is str)
+            
+            if float in value_types and value_types <= {float, str} and not has_text:
+                numbers = np.array([np.nan if value == "" else value for value in values], dtype='<f8')
+                columns.append({'type': 'f8', 'data': Binary(numbers.tobytes())})
+            elif value_types == {str}:
+                codes, table = pd.factorize(pd.Series(values, dtype=object))
+                columns.append({'type': 'str', 'table': table.tolist(), 'codes': Binary(codes.astype('<i4').tobytes())})
             else:
-                unique_headers.append(header)
+                columns.append({'type': 'obj', 'values': values})
         
-        # 使用唯一列名重建DataFrame，但保存原始表头用于显示
-        df.columns = unique_headers
-        
-        result = []
-        for index, row in df.iterrows():
-            row_dict = {}
-            for col_idx, value in enumerate(row):
-                col_key = f"col_{col_idx}"
-                if pd.isna(value):
-                    row_dict[col_key] = ""
-                elif isinstance(value, (int, float)):
-                    row_dict[col_key] = float(value) if not pd.isna(value) else 0.0
-                else:
-                    # 修复CSV中的#NAME?错误
-                    value_str = str(value).strip()
-                    if value_str.startswith('='):
-                        # 处理Excel公式，特别是"=--平台内支出"这类
-                        if '平台内支出' in value_str:
-                            row_dict[col_key] = "--平台内支出"
-                        elif value_str.startswith('=--'):
-                            row_dict[col_key] = value_str[3:]  # 去除"=--"
-                        else:
-                            row_dict[col_key] = value_str[1:]  # 去除"="
-                    else:
-                        row_dict[col_key] = value_str
-            result.append(row_dict)
+        return {'format': ReportModel.COLUMNAR_FORMAT, 'row_count': len(excel_data), 'columns': columns}
+    
+    @staticmethod
+    def decode_columnar(raw_data: Dict, column_count: int) -> List[np.ndarray]:
+        """将列式结构解码为列数组，数值列无空值时为float64数组，否则为对象数组（空值为空字符串）"""
+        if raw_data.get('format') != ReportModel.COLUMNAR_FORMAT:
+            raise ValueError(f"不支持的报表数据格式: {raw_data.get('format')}")
+        
+        row_count = raw_data['row_count']
+        decoded = []
+        for column in raw_data['columns'][:column_count]:
+            if column['type'] == 'f8':
+                numbers = np.frombuffer(column['data'], dtype='<f8').astype(float)
+                blank_mask = np.isnan(numbers)
+                if blank_mask.any():
+                    numbers = numbers.astype(object)
+                    numbers[blank_mask] = ""
+                decoded.append(numbers)
+            elif column['type'] == 'str':
+                codes = np.frombuffer(column['codes'], dtype='<i4')
+                decoded.append(np.array(column['table'], dtype=object)[codes])
+            else:
+                values = np.empty(row_count, dtype=object)
+                values[:] = column['values']
+                decoded.append(values)
         
-        return result, headers
+        while len(decoded) < column_count:
+            decoded.append(np.full(row_count, "", dtype=object))
+        return decoded
+    
+    @staticmethod
+    def compute_content_hash(excel_data: List[Dict], headers: List[str], financial_data: Dict) -> str:
+        """计算工作表内容指纹，内容不变时重复上传可跳过写入"""
+        return sheet_conversion.compute_content_hash(excel_data, headers, financial_data)
+    
+    @staticmethod
+    def dataframe_to_dict_list(df: pd.DataFrame) -> tuple[List[Dict], List[str]]:
+        """将DataFrame转换为字典列表，保留表头信息并修复#NAME?错误，处理空白表头"""
+        return sheet_conversion.dataframe_to_dict_list(df)
 
 class PermissionModel:
     """权限数据模型"""
@@ -255,6 +936,46 @@ class PermissionModel:
             'status': kwargs.get('status', 'active')
         }
 
+# 门店索引
+class StoreIndex:
+    """门店内存索引，按门店名称、标准化名称和别名查找门店，避免逐个工作表查询数据库"""
+    
+    def __init__(self, stores: List[Dict] = ()):
+        self.by_name = {}
+        self.by_normalized_name = {}
+        self.by_alias = {}
+        for store in stores:
+            self.add(store)
+    
+    @classmethod
+    def load(cls, stores_collection) -> 'StoreIndex':
+        """一次性加载全部门店构建索引"""
+        return cls(stores_collection.find({}, {'store_name': 1, 'store_code': 1, 'aliases': 1}))
+    
+    def add(self, store: Dict):
+        """加入门店，同名或同别名时保留先加入的门店"""
+        self.by_name.setdefault(store['store_name'], store)
+        normalized_name = StoreModel.normalized_key(store['store_name'])
+        if normalized_name:
+            self.by_normalized_name.setdefault(normalized_name, store)
+        for alias in store.get('aliases', []):
+            if alias:
+                self.by_alias.setdefault(alias, store)
+    
+    def find(self, store_name: str) -> Optional[Dict]:
+        """依次按精确名称、标准化名称（不区分大小写）、别名查找门店"""
+        store = self.by_name.get(store_name)
+        if store:
+            return store
+        
+        normalized_name = StoreModel.normalize_store_name(store_name)
+        if normalized_name:
+            store = self.by_normalized_name.get(normalized_name.lower()) or self.by_alias.get(normalized_name)
+            if store:
+                return store
+        
+        return self.by_alias.get(store_name)
+
 # 批量上传器
 class BulkReportUploader:
     """批量报表上传器"""
@@ -265,27 +986,38 @@ class BulkReportUploader:
         self.db = db
         self.stores_collection = self.db['stores']
         self.reports_collection = self.db['reports']
+        self.summaries_collection = self.db['report_summaries']
+        self.storage_format = ConfigManager.get_report_storage_format()
     
     def normalize_store_name(self, sheet_name: str) -> str:
         """标准化门店名称"""
-        name = sheet_name.strip()
-        name = name.replace('犀牛百货', '').replace('门店', '').replace('店', '')
-        name = name.replace('(', '').replace(')', '').replace('（', '').replace('）', '')
-        name = ''.join(name.split())
-        return name
+        return StoreModel.normalize_store_name(sheet_name)
     
-    def find_or_create_store(self, sheet_name: str) -> Optional[Dict]:
-        """通过sheet名称查找门店，如果不存在则创建"""
+    def find_or_create_store(self, sheet_name: str, store_index: Optional[StoreIndex] = None) -> Dict:
+        """通过sheet名称查找门店，如果不存在则创建；提供store_index时只在内存索引中查找，新建门店同时加入索引
+        
+        创建门店失败时抛出异常，由调用方记入处理结果（上传可能在后台线程中执行，不能直接调用st.error）
+        """
+        if store_index is not None:
+            store = store_index.find(sheet_name)
+            if store:
+                return store
+            store = self._create_store_from_sheet_name(sheet_name)
+            store_index.add(store)
+            return store
+        
         normalized_name = self.normalize_store_name(sheet_name)
         
-        # 查找现有门店
+        # 查找现有门店，各条件均有索引
         search_patterns = [
             {"store_name": sheet_name},
-            {"store_name": {"$regex": normalized_name, "$options": "i"}},
+            {"normalized_name": normalized_name.lower()} if normalized_name else None,
             {"aliases": {"$in": [sheet_name, normalized_name]}},
         ]
         
         for pattern in search_patterns:
+            if pattern is None:
+                continue
             try:
                 store = self.stores_collection.find_one(pattern)
                 if store:
@@ -296,22 +1028,36 @@ class BulkReportUploader:
         # 创建新门店
         return self._create_store_from_sheet_name(sheet_name)
     
-    def _create_store_from_sheet_name(self, sheet_name: str) -> Optional[Dict]:
-        """从工作表名称创建新门店"""
+    def _new_store_document(self, sheet_name: str) -> Dict:
+        """以工作表名称构建新门店文档（不写入数据库）"""
+        return StoreModel.create_store_document(
+            store_name=sheet_name.strip(),
+            aliases=[sheet_name.strip(), self.normalize_store_name(sheet_name)],
+            created_by='bulk_upload'
+        )
+    
+    def _create_store_from_sheet_name(self, sheet_name: str) -> Dict:
+        """从工作表名称创建新门店，失败时抛出异常"""
         try:
-            store_data = StoreModel.create_store_document(
-                store_name=sheet_name.strip(),
-                aliases=[sheet_name.strip(), self.normalize_store_name(sheet_name)],
-                created_by='bulk_upload'
-            )
+            store_data = self._new_store_document(sheet_name)
             self.stores_collection.insert_one(store_data)
             return store_data
         except Exception as e:
-            st.error(f"创建门店失败: {e}")
-            return None
+            raise Exception(f"创建门店失败: {e}") from e
     
-    def process_excel_file(self, file_buffer, report_month: str, clear_history: bool = True, progress_callback=None) -> Dict:
-        """处理Excel文件并上传报表数据"""
+    def process_excel_file(self, file_buffer, report_month: str, clear_history: bool = True, progress_callback=None,
+                           batch_size: int = 100, max_workers: int = 1, streaming: bool = False,
+                           incremental: bool = False, dry_run: bool = False) -> Dict:
+        """处理Excel文件并上传报表数据
+        
+        报表文档按batch_size分批写入，max_workers>1时并行转换工作表。
+        streaming=True时逐个工作表读取、转换并写入，内存占用不随工作表数量增长。
+        incremental=True时不清除历史数据，按内容指纹只改写有变化的门店、新增新门店并删除文件中已不存在的门店。
+        clear_history=False时已有门店的报表原地替换（内容未变化时跳过），每个门店每月只保留一份报表。
+        result['timings']记录各阶段累计耗时（秒）；并行转换时转换阶段为各子进程耗时之和。
+        dry_run=True时不写入数据库，只与该月份已有报表的内容指纹比较，在result['diff']中列出将新建的门店，
+        以及将新增、更新、保持不变和删除的报表；完全覆盖模式下已有门店的报表均计为更新（替换）。
+        """
         start_time = time.time()
         result = {
             'success_count': 0,
@@ -320,61 +1066,119 @@ class BulkReportUploader:
             'processed_stores': [],
             'failed_stores': [],
             'total_time': 0,
-            'cleared_count': 0
+            'parse_time': 0,
+            'cleared_count': 0,
+            'unchanged_count': 0,
+            'updated_count': 0,
+            'inserted_count': 0,
+            'removed_count': 0,
+            'timings': {
+                'clear': 0,
+                'parse': 0,
+                'build_dataframes': 0,
+                'dataframe_to_dict_list': 0,
+                'extract_financial_data': 0,
+                'content_hash': 0,
+                'store_resolution': 0,
+                'build_documents': 0,
+                'writes': 0
+            }
         }
+        timings = result['timings']
+        if dry_run:
+            result['diff'] = {'stores_to_create': [], 'inserted': [], 'updated': [], 'unchanged': [], 'removed': []}
         
         try:
             if progress_callback:
                 progress_callback(5, "准备上传，清理历史数据...")
             
-            # 1. 完全清除历史数据
-            if clear_history:
+            # 1. 完全清除历史数据（不清除时与已有报表的内容指纹比较，已有门店的报表原地替换）
+            clear_start = time.time()
+            existing_reports = {}
+            stale_report_ids = []
+            if incremental or dry_run or not clear_history:
+                for report in self.reports_collection.find(
+                    {'report_month': report_month},
+                    {'store_id': 1, 'store_name': 1, 'content_hash': 1, 'created_at': 1}
+                ):
+                    if report['store_id'] in existing_reports:
+                        stale_report_ids.append(report['_id'])
+                    else:
+                        existing_reports[report['store_id']] = report
+            if dry_run:
+                # 预览模式不清除数据，只统计将被清除的报表数量
+                if clear_history and not incremental:
+                    result['cleared_count'] = len(existing_reports) + len(stale_report_ids)
+            elif clear_history and not incremental:
                 try:
                     clear_result = self.reports_collection.delete_many({'report_month': report_month})
                     result['cleared_count'] = clear_result.deleted_count
+                    self.summaries_collection.delete_many({'report_month': report_month})
                     if progress_callback:
                         progress_callback(10, f"已清除 {result['cleared_count']} 条历史数据")
                 except Exception as e:
                     result['errors'].append(f"清除历史数据失败: {str(e)}")
+            timings['clear'] = time.time() - clear_start
             
             if progress_callback:
                 progress_callback(15, "正在读取Excel文件...")
             
-            # 2. 读取Excel文件 - 以第2行为表头用于显示，第4行为表头用于财务提取
-            excel_data_display = pd.read_excel(file_buffer, sheet_name=None, engine='openpyxl', header=1)  # header=1 表示第2行为表头用于显示
-            excel_data_financial = pd.read_excel(file_buffer, sheet_name=None, engine='openpyxl', header=3)  # header=3 表示第4行为表头用于财务提取
-            total_sheets = len(excel_data_display)
+            # 2. 读取Excel文件 - 每个工作表只解析一次，再分别以第2行（显示）和第4行（财务提取）为表头构建数据
+            parse_start = time.time()
+            workbook = self._open_workbook(file_buffer)
+            result['parse_time'] = time.time() - parse_start
+            total_sheets = len(workbook.sheetnames)
+            sheet_grids = self._iter_sheet_grids(workbook, result)
+            if not streaming:
+                sheet_grids = list(sheet_grids)
             
             if progress_callback:
                 progress_callback(20, f"发现 {total_sheets} 个工作表，开始处理...")
             
+            # 预加载门店索引，工作表匹配门店时不再逐个查询数据库
+            resolution_start = time.time()
+            store_index = StoreIndex.load(self.stores_collection)
+            timings['store_resolution'] += time.time() - resolution_start
+            
             processed = 0
+            pending_reports = []
+            # 文件中出现的门店，增量模式下不在其中的门店报表视为已移除
+            seen_store_ids = set()
             
-            for sheet_name in excel_data_display.keys():
+            for sheet_name, get_converted_sheet in self._iter_converted_sheets(sheet_grids, max_workers):
                 try:
                     processed += 1
                     progress = 20 + (processed / total_sheets) * 70
                     if progress_callback:
                         progress_callback(progress, f"正在处理: {sheet_name}")
                     
-                    store = self.find_or_create_store(sheet_name)
-                    if not store:
+                    resolution_start = time.time()
+                    if dry_run:
+                        store = store_index.find(sheet_name)
+                        if not store:
+                            # 预览模式不创建门店，占位门店加入索引，后续对应同一门店的工作表与实际上传结果一致
+                            result['diff']['stores_to_create'].append(sheet_name)
+                            store = self._new_store_document(sheet_name)
+                            store_index.add(store)
+                    else:
+                        store = self.find_or_create_store(sheet_name, store_index)
+                    timings['store_resolution'] += time.time() - resolution_start
+                    if store['_id'] in seen_store_ids:
+                        # 每个门店每月只保留一份报表（唯一索引约束）
                         result['failed_stores'].append({
                             'store_name': sheet_name,
-                            'reason': '无法创建门店记录'
+                            'reason': f"与其他工作表对应同一门店 {store['store_name']}，已跳过"
                         })
                         result['failed_count'] += 1
                         continue
+                    # 工作表对应到门店即视为文件中包含该门店，之后转换或写入失败也不会删除其已有报表
+                    seen_store_ids.add(store['_id'])
                     
-                    # 3. 处理显示数据 - 使用第2行为表头
-                    df_display = excel_data_display[sheet_name]
-                    df_display_cleaned = df_display.dropna(axis=1, how='all')
-                    
-                    # 4. 处理财务数据 - 使用第4行为表头
-                    df_financial = excel_data_financial[sheet_name]
-                    df_financial_cleaned = df_financial.dropna(axis=1, how='all')
-                    
-                    if df_display_cleaned.empty:
+                    # 3-6. 获取转换结果（显示数据第2行为表头，财务数据第4行为表头）
+                    converted_sheet = get_converted_sheet()
+                    for stage, elapsed in converted_sheet['timings'].items():
+                        timings[stage] += elapsed
+                    if converted_sheet['empty']:
                         result['failed_stores'].append({
                             'store_name': sheet_name,
                             'reason': '显示数据为空'
@@ -382,13 +1186,40 @@ class BulkReportUploader:
                         result['failed_count'] += 1
                         continue
                     
-                    # 5. 转换显示数据格式，保存表头
-                    excel_data_dict, headers = ReportModel.dataframe_to_dict_list(df_display_cleaned)
+                    excel_data_dict = converted_sheet['excel_data']
+                    headers = converted_sheet['headers']
+                    financial_data = converted_sheet['financial_data']
+                    content_hash = converted_sheet['content_hash']
                     
-                    # 6. 提取财务数据（使用第4行表头的数据）
-                    financial_data = self._extract_financial_data_v2(df_financial_cleaned)
+                    existing_report = existing_reports.get(store['_id'])
+                    # 完全覆盖模式下已有报表会先被清除再重新写入，预览中不计为内容未变化
+                    if existing_report and existing_report.get('content_hash') == content_hash and not (clear_history and not incremental):
+                        # 内容未变化，跳过写入
+                        result['unchanged_count'] += 1
+                        result['success_count'] += 1
+                        result['processed_stores'].append({
+                            'sheet_name': sheet_name,
+                            'store_name': store['store_name'],
+                            'store_code': store['store_code']
+                        })
+                        if dry_run:
+                            result['diff']['unchanged'].append(sheet_name)
+                        continue
+                    
+                    if dry_run:
+                        action = 'updated' if existing_report else 'inserted'
+                        result[f'{action}_count'] += 1
+                        result['success_count'] += 1
+                        result['processed_stores'].append({
+                            'sheet_name': sheet_name,
+                            'store_name': store['store_name'],
+                            'store_code': store['store_code']
+                        })
+                        result['diff'][action].append(sheet_name)
+                        continue
                     
                     # 7. 创建报表文档
+                    build_start = time.time()
                     report_data = ReportModel.create_report_document(
                         store_data=store,
                         report_month=report_month,
@@ -396,18 +1227,22 @@ class BulkReportUploader:
                         headers=headers,  # 保存第2行表头用于显示
                         sheet_name=sheet_name,
                         financial_data=financial_data,
-                        uploaded_by='bulk_upload'
+                        content_hash=content_hash,
+                        created_at=existing_report.get('created_at') if existing_report else None,
+                        uploaded_by='bulk_upload',
+                        storage_format=self.storage_format
                     )
+                    timings['build_documents'] += time.time() - build_start
                     
-                    # 8. 保存到数据库（不检查existing，因为已经清空）
-                    self.reports_collection.insert_one(report_data)
-                    
-                    result['success_count'] += 1
-                    result['processed_stores'].append({
-                        'sheet_name': sheet_name,
-                        'store_name': store['store_name'],
-                        'store_code': store['store_code']
-                    })
+                    # 8. 加入待写入批次（完全覆盖模式下不检查existing，因为已经清空）
+                    report_data['_id'] = existing_report['_id'] if existing_report else ObjectId()
+                    summary = ReportModel.create_summary_document(report_data)
+                    if existing_report:
+                        pending_reports.append((sheet_name, store, 'updated', ReplaceOne({'_id': existing_report['_id']}, report_data), summary))
+                    else:
+                        pending_reports.append((sheet_name, store, 'inserted', InsertOne(report_data), summary))
+                    if len(pending_reports) >= batch_size:
+                        self._flush_report_batch(pending_reports, result)
                 
                 except Exception as e:
                     result['failed_stores'].append({
@@ -417,169 +1252,393 @@ class BulkReportUploader:
                     result['failed_count'] += 1
                     result['errors'].append(f"{sheet_name}: {str(e)}")
             
+            self._flush_report_batch(pending_reports, result)
+            
+            # 9. 增量模式：删除文件中已不存在的门店报表及重复报表；有工作表处理或写入失败时不删除，避免丢失旧数据
+            if incremental and result['failed_count']:
+                result['errors'].append(f"{result['failed_count']} 个工作表处理或写入失败，未删除文件中已不存在的门店报表")
+            elif dry_run:
+                if incremental or clear_history:
+                    removed_reports = [report for store_id, report in existing_reports.items() if store_id not in seen_store_ids]
+                    result['diff']['removed'] = [report.get('store_name') or report['store_id'] for report in removed_reports]
+                    result['removed_count'] = len(removed_reports) + len(stale_report_ids)
+            elif incremental:
+                removed_start = time.time()
+                removed_filter = {'report_month': report_month, '$or': [{'store_id': {'$nin': list(seen_store_ids)}}]}
+                if stale_report_ids:
+                    removed_filter['$or'].append({'_id': {'$in': stale_report_ids}})
+                try:
+                    result['removed_count'] = self.reports_collection.delete_many(removed_filter).deleted_count
+                    summaries_filter = {'report_month': report_month, '$or': [{'store_id': {'$nin': list(seen_store_ids)}}]}
+                    if stale_report_ids:
+                        summaries_filter['$or'].append({'report_id': {'$in': stale_report_ids}})
+                    self.summaries_collection.delete_many(summaries_filter)
+                except Exception as e:
+                    result['errors'].append(f"删除已移除门店报表失败: {str(e)}")
+                timings['clear'] += time.time() - removed_start
+            
             if progress_callback:
-                progress_callback(100, "上传完成！")
+                progress_callback(100, "预览完成！" if dry_run else "上传完成！")
             
         except Exception as e:
             result['errors'].append(f"文件处理失败: {str(e)}")
         
+        # 递增数据版本，使查询页缓存失效
+        if not dry_run:
+            try:
+                DataVersionManager.bump(self.db, report_month)
+            except Exception as e:
+                result['errors'].append(f"更新数据版本失败: {str(e)}")
+        
+        timings['parse'] = result['parse_time']
         result['total_time'] = time.time() - start_time
         return result
     
-    def _extract_financial_data_v2(self, df: pd.DataFrame) -> Dict:
-        """改进的财务数据提取 - 第4行为表头，查找合计列，从第37行提取总部应收未收金额"""
-        financial_data = {
-            'revenue': {},
-            'cost': {},
-            'profit': {},
-            'receivables': {},
-            'other_metrics': {}
-        }
-        
+    @staticmethod
+    def _worker_context():
+        """并行转换子进程的启动方式
+        
+        上传在Streamlit服务线程或后台任务线程中执行，fork会复制持有中的锁和数据库连接，因此使用forkserver
+        （不支持时使用spawn）启动子进程；子进程只导入不依赖Streamlit和数据库的sheet_conversion模块。
+        """
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return multiprocessing.get_context(start_method)
+    
+    def _iter_converted_sheets(self, sheet_grids, max_workers: int):
+        """按工作表顺序产出(工作表名称, 获取转换结果的函数)
+        
+        max_workers>1时工作表提交到进程池并行转换，同时在途的工作表不超过max_workers的两倍；
+        否则在当前线程中按需转换。子进程启动需要重新导入pandas，工作表较少时并行转换反而更慢。
+        """
+        if max_workers > 1:
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=self._worker_context()) as executor:
+                in_flight = deque()
+                for sheet_name, grid in sheet_grids:
+                    in_flight.append((sheet_name, executor.submit(sheet_conversion.convert_sheet, grid)))
+                    if len(in_flight) >= max_workers * 2:
+                        sheet_name, future = in_flight.popleft()
+                        yield sheet_name, future.result
+                while in_flight:
+                    sheet_name, future = in_flight.popleft()
+                    yield sheet_name, future.result
+        else:
+            for sheet_name, grid in sheet_grids:
+                yield sheet_name, functools.partial(sheet_conversion.convert_sheet, grid)
+    
+    def _flush_report_batch(self, pending_reports: List[Tuple[str, Dict, str, Any, Dict]], result: Dict):
+        """以无序bulk_write批量写入报表文档，写入失败的文档按工作表名称记入failed_stores，写入成功的报表同步更新报表摘要
+        
+        pending_reports中每项为(工作表名称, 门店, 写入类型, 写入操作, 报表摘要)，写入类型为inserted或updated。
+        """
+        if not pending_reports:
+            return
+        
+        write_errors = {}
+        write_start = time.time()
+        try:
+            self.reports_collection.bulk_write(
+                [operation for _, _, _, operation, _ in pending_reports],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                write_errors[error['index']] = error.get('errmsg', '未知错误')
+        except Exception as e:
+            write_errors = {index: str(e) for index in range(len(pending_reports))}
+        result['timings']['writes'] += time.time() - write_start
+        
+        summary_operations = []
+        for index, (sheet_name, store, action, _, summary) in enumerate(pending_reports):
+            if index in write_errors:
+                result['failed_stores'].append({
+                    'store_name': sheet_name,
+                    'reason': f"写入失败: {write_errors[index]}"
+                })
+                result['failed_count'] += 1
+                result['errors'].append(f"{sheet_name}: {write_errors[index]}")
+            else:
+                result['success_count'] += 1
+                result[f'{action}_count'] += 1
+                result['processed_stores'].append({
+                    'sheet_name': sheet_name,
+                    'store_name': store['store_name'],
+                    'store_code': store['store_code']
+                })
+                summary_operations.append(ReplaceOne(
+                    {'store_id': summary['store_id'], 'report_month': summary['report_month']},
+                    summary,
+                    upsert=True
+                ))
+        
+        # 报表摘要写入失败不影响报表本身，查询页找不到摘要时会从报表重建
+        write_start = time.time()
+        try:
+            if summary_operations:
+                self.summaries_collection.bulk_write(summary_operations, ordered=False)
+        except Exception as e:
+            result['errors'].append(f"报表摘要写入失败: {str(e)}")
+        result['timings']['writes'] += time.time() - write_start
+        
+        pending_reports.clear()
+    
+    def rebuild_report_summaries(self, report_month: str = None) -> int:
+        """根据已有报表重建报表摘要，用于回填历史数据；同一门店同一月份有多份报表时以最后更新的为准
+        
+        摘要按唯一索引（门店、月份）原地替换，重建过程中查询页始终能读到摘要，也不会与并发上传写入的摘要冲突；
+        替换完成后再删除没有对应报表的摘要
+        """
+        month_filter = {'report_month': report_month} if report_month else {}
+        
+        summaries = {}
+        for report in self.reports_collection.find(
+            month_filter,
+            {'raw_excel_data': 0, 'table_headers': 0}
+        ).sort('updated_at', 1):
+            summaries[(report['store_id'], report['report_month'])] = ReportModel.create_summary_document(report)
+        
+        summary_list = list(summaries.values())
+        for start in range(0, len(summary_list), 500):
+            self.summaries_collection.bulk_write([
+                ReplaceOne(
+                    {'store_id': summary['store_id'], 'report_month': summary['report_month']},
+                    summary,
+                    upsert=True
+                )
+                for summary in summary_list[start:start + 500]
+            ], ordered=False)
+        
+        report_ids = [summary['report_id'] for summary in summary_list]
+        self.summaries_collection.delete_many({**month_filter, 'report_id': {'$nin': report_ids}})
+        
+        rebuilt_months = {summary['report_month'] for summary in summary_list}
+        if report_month:
+            rebuilt_months.add(report_month)
+        for month in rebuilt_months:
+            DataVersionManager.bump(self.db, month)
+        return len(summary_list)
+    
+    @staticmethod
+    def _convert_cell(cell) -> Any:
+        """转换单元格取值，规则与pandas的openpyxl读取器保持一致"""
+        if cell.value is None:
+            return ""
+        elif cell.data_type == TYPE_ERROR:
+            return np.nan
+        elif cell.data_type == TYPE_NUMERIC:
+            value = int(cell.value)
+            if value == cell.value:
+                return value
+            return float(cell.value)
+        return cell.value
+    
+    @staticmethod
+    def _open_workbook(file_buffer):
+        """以只读模式打开工作簿，工作表内容在遍历时才解析"""
+        if hasattr(file_buffer, 'seek'):
+            file_buffer.seek(0)
+        return load_workbook(file_buffer, read_only=True, data_only=True, keep_links=False)
+    
+    def _iter_sheet_grids(self, workbook, result: Dict):
+        """逐个工作表解析单元格网格并累计解析耗时，遍历结束后关闭工作簿"""
+        try:
+            for sheet in workbook.worksheets:
+                parse_start = time.time()
+                grid = self._read_sheet_grid(sheet)
+                result['parse_time'] += time.time() - parse_start
+                yield sheet.title, grid
+        finally:
+            workbook.close()
+    
+    def _read_sheet_grid(self, sheet) -> List[List[Any]]:
+        """读取单个工作表的单元格网格（去除末尾空行空列）"""
+        sheet.reset_dimensions()
+        grid = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.rows):
+            values = [self._convert_cell(cell) for cell in row]
+            while values and values[-1] == "":
+                values.pop()
+            if values:
+                last_row_with_data = row_number
+            grid.append(values)
+        
+        grid = grid[:last_row_with_data + 1]
+        if grid:
+            max_width = max(len(values) for values in grid)
+            grid = [values + [""] * (max_width - len(values)) for values in grid]
+        return grid
+    
+# 后台上传任务
+class UploadJobManager:
+    """后台上传任务管理器
+    
+    上传任务在独立的后台线程中按提交顺序依次执行，不受Streamlit脚本重跑影响；
+    任务状态、进度、各工作表处理结果和耗时持久化在upload_jobs集合中，页面通过轮询任务文档展示进度。
+    任务归属于提交它的进程（worker_id），进程定期刷新其未完成任务的心跳，心跳超时的任务视为进程已退出。
+    """
+    
+    ACTIVE_STATUSES = ['queued', 'running']
+    # 进度写入数据库的最小间隔（秒），避免每个工作表都写一次任务文档
+    PROGRESS_UPDATE_INTERVAL = 0.5
+    # 心跳刷新间隔和超时时间（秒）
+    HEARTBEAT_INTERVAL = 10
+    HEARTBEAT_TIMEOUT = 60
+    
+    def __init__(self, db):
+        self.db = db
+        self.jobs_collection = db['upload_jobs']
+        self.worker_host = socket.gethostname()
+        # 同一主机（或同名容器）上可能运行多个Streamlit进程，任务归属以进程为单位
+        self.worker_id = f"{self.worker_host}:{os.getpid()}:{uuid.uuid4().hex}"
+        # 同一时间只执行一个上传任务，其余任务排队，避免同一月份的清理和写入互相交错
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-job')
+        self._create_indexes()
+        self._mark_interrupted_jobs()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='upload-job-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+    
+    def _create_indexes(self):
+        """创建任务集合索引"""
+        try:
+            self.jobs_collection.create_index([("submitted_at", -1)], background=True)
+        except Exception:
+            pass
+    
+    def _heartbeat_loop(self):
+        """定期刷新本进程未完成任务的心跳，并清理其他已退出进程遗留的任务"""
+        while True:
+            time.sleep(self.HEARTBEAT_INTERVAL)
+            try:
+                self.jobs_collection.update_many(
+                    {'status': {'$in': self.ACTIVE_STATUSES}, 'worker_id': self.worker_id},
+                    {'$set': {'heartbeat_at': datetime.now()}}
+                )
+            except Exception:
+                pass
+            self._mark_interrupted_jobs()
+    
+    def _mark_interrupted_jobs(self):
+        """将心跳超时的未完成任务标记为已中断
+        
+        待处理文件只保存在提交任务的进程内存中，进程退出或应用重启后无法继续执行；
+        其他仍在运行的进程会持续刷新心跳，其任务不受影响
+        """
+        try:
+            self.jobs_collection.update_many(
+                {
+                    'status': {'$in': self.ACTIVE_STATUSES},
+                    'worker_id': {'$ne': self.worker_id},
+                    '$or': [
+                        {'heartbeat_at': {'$lt': datetime.now() - timedelta(seconds=self.HEARTBEAT_TIMEOUT)}},
+                        {'heartbeat_at': {'$exists': False}}
+                    ]
+                },
+                {'$set': {
+                    'status': 'interrupted',
+                    'message': '处理任务的进程已退出，任务已中断，请重新提交',
+                    'finished_at': datetime.now()
+                }}
+            )
+        except Exception:
+            pass
+    
+    def submit(self, file_bytes: bytes, file_name: str, report_month: str, options: Dict = None,
+               submitted_by: str = 'admin') -> str:
+        """提交上传任务，返回任务ID"""
+        options = dict(options or {})
+        job_id = f"job_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.jobs_collection.insert_one({
+            '_id': job_id,
+            'file_name': file_name,
+            'file_size': len(file_bytes),
+            'report_month': report_month,
+            'options': options,
+            'status': 'queued',
+            'progress': 0,
+            'message': '排队中...',
+            'result': None,
+            'error': None,
+            'worker_host': self.worker_host,
+            'worker_id': self.worker_id,
+            'heartbeat_at': datetime.now(),
+            'submitted_by': submitted_by,
+            'submitted_at': datetime.now(),
+            'started_at': None,
+            'finished_at': None,
+            'updated_at': datetime.now()
+        })
+        self.executor.submit(self._run_job, job_id, file_bytes, report_month, options)
+        return job_id
+    
+    def _update_job(self, job_id: str, fields: Dict):
+        fields['updated_at'] = datetime.now()
+        self.jobs_collection.update_one({'_id': job_id}, {'$set': fields})
+    
+    def _run_job(self, job_id: str, file_bytes: bytes, report_month: str, options: Dict):
+        """在后台线程中执行上传任务"""
         try:
-            # 1. 查找合计列
-            total_col_indices = []
+            started_at = datetime.now()
+            self._update_job(job_id, {'status': 'running', 'started_at': started_at, 'message': '开始处理...'})
             
-            for col_idx, col_name in enumerate(df.columns):
-                col_str = str(col_name).lower().strip()
-                if any(keyword in col_str for keyword in [
-                    '合计', 'total', '总计', '小计', 'sum', '汇总',
-                    '金额', '总金额', '合计金额', '小计金额',
-                    '总额', '总和', '累计', '统计'
-                ]):
-                    total_col_indices.append(col_idx)
+            last_update = [0.0]
             
-            # 如果没有找到合计列，按数值含量智能识别
-            if not total_col_indices:
-                numeric_counts = []
-                for col_idx in range(len(df.columns)):
-                    try:
-                        numeric_count = df.iloc[:, col_idx].apply(lambda x: pd.to_numeric(x, errors='coerce')).notna().sum()
-                        numeric_counts.append((col_idx, numeric_count))
-                    except:
-                        numeric_counts.append((col_idx, 0))
-                
-                # 按数字含量排序，取前2个作为合计列
-                numeric_counts.sort(key=lambda x: x[1], reverse=True)
-                if len(numeric_counts) >= 2:
-                    total_col_indices = [numeric_counts[0][0], numeric_counts[1][0]]
+            def update_progress(progress, message):
+                now = time.time()
+                if progress >= 100 or now - last_update[0] >= self.PROGRESS_UPDATE_INTERVAL:
+                    last_update[0] = now
+                    self._update_job(job_id, {'progress': progress, 'message': message})
             
-            # 调试信息：记录列识别结果
-            financial_data['other_metrics']['所有列名'] = [str(col) for col in df.columns]
-            financial_data['other_metrics']['合计列位置'] = str(total_col_indices)
-            financial_data['other_metrics']['合计列数量'] = len(total_col_indices)
-            if total_col_indices:
-                financial_data['other_metrics']['合计列名称'] = [str(df.columns[i]) for i in total_col_indices]
+            uploader = BulkReportUploader(self.db)
+            result = uploader.process_excel_file(
+                io.BytesIO(file_bytes),
+                report_month,
+                progress_callback=update_progress,
+                **options
+            )
             
-            # 2. 直接从第37行第2个合计列提取总部应收未收金额
-            if len(df) >= 37 and len(total_col_indices) >= 2:
-                target_row_index = 36  # 第37行（索引36，因为第4行为表头）
-                target_col_idx = total_col_indices[1]  # 使用第二个合计列
-                column_desc = f"第{target_col_idx+1}列(第2个合计列)"
-                
-                try:
-                    # 直接提取第37行第2个合计列的值
-                    raw_value = df.iloc[target_row_index, target_col_idx]
-                    financial_data['other_metrics']['第37行第2合计列原值'] = str(raw_value)
-                    financial_data['other_metrics']['使用列索引'] = target_col_idx
-                    financial_data['other_metrics']['使用列描述'] = column_desc
-                    
-                    parsed_value = pd.to_numeric(raw_value, errors='coerce')
-                    if not pd.isna(parsed_value):
-                        # 保存原始数值
-                        financial_data['receivables']['net_amount'] = float(parsed_value)
-                        financial_data['other_metrics']['总部应收未收金额'] = float(parsed_value)
-                        
-                        # 格式化为两位小数和千分位
-                        formatted_value = f"{parsed_value:,.2f}"
-                        financial_data['other_metrics']['格式化金额'] = formatted_value
-                        
-                        financial_data['other_metrics']['提取位置'] = f"第37行{column_desc}"
-                        financial_data['other_metrics']['提取成功'] = True
-                        financial_data['other_metrics']['数值处理'] = f"原始值: {parsed_value}, 格式化: {formatted_value}"
-                    else:
-                        financial_data['other_metrics']['提取失败原因'] = "数值转换失败"
-                        
-                except (ValueError, TypeError, IndexError) as e:
-                    financial_data['other_metrics']['提取失败原因'] = f"异常: {str(e)}"
-                    
+            if result['success_count'] == 0 and (result['failed_count'] > 0 or result['errors']):
+                status = 'failed'
             else:
-                if len(df) < 37:
-                    financial_data['other_metrics']['提取失败原因'] = f"数据行数不足37行，实际{len(df)}行"
-                elif len(total_col_indices) < 2:
-                    financial_data['other_metrics']['提取失败原因'] = f"合计列数不足2列，实际{len(total_col_indices)}列"
-            
-            # 3. 提取其他财务指标
-            for idx, row in df.iterrows():
-                try:
-                    if len(row) < 2:
-                        continue
-                    
-                    metric_name = str(row.iloc[0]).strip() if pd.notna(row.iloc[0]) else ""
-                    if not metric_name:
-                        continue
-                    
-                    # 查找数值（优先从合计列取值）
-                    value = None
-                    
-                    # 先从合计列查找
-                    for col_idx in total_col_indices:
-                        if col_idx < len(row):
-                            try:
-                                if pd.notna(row.iloc[col_idx]):
-                                    value = float(row.iloc[col_idx])
-                                    break
-                            except:
-                                continue
-                    
-                    # 如果合计列没有值，从其他列查找
-                    if value is None:
-                        for col_idx in range(1, len(row)):
-                            if col_idx not in total_col_indices:  # 跳过合计列
-                                try:
-                                    if pd.notna(row.iloc[col_idx]):
-                                        value = float(row.iloc[col_idx])
-                                        break
-                                except:
-                                    continue
-                    
-                    if value is None:
-                        value = 0
-                    
-                    # 4. 分类存储财务指标
-                    if any(keyword in metric_name for keyword in ['收入', '营收', '销售额', '营业收入']):
-                        if '线上' in metric_name:
-                            financial_data['revenue']['online_revenue'] = value
-                        elif '线下' in metric_name:
-                            financial_data['revenue']['offline_revenue'] = value
-                        elif '总' in metric_name or '合计' in metric_name:
-                            financial_data['revenue']['total_revenue'] = value
-                    
-                    elif any(keyword in metric_name for keyword in ['成本', '费用', '支出']):
-                        if '商品' in metric_name:
-                            financial_data['cost']['product_cost'] = value
-                        elif '租金' in metric_name or '房租' in metric_name:
-                            financial_data['cost']['rent_cost'] = value
-                        elif '人工' in metric_name or '工资' in metric_name:
-                            financial_data['cost']['labor_cost'] = value
-                    
-                    elif any(keyword in metric_name for keyword in ['利润', '盈利', '净利', '毛利']):
-                        if '毛利' in metric_name:
-                            financial_data['profit']['gross_profit'] = value
-                        elif '净利' in metric_name:
-                            financial_data['profit']['net_profit'] = value
-                    
-                    # 保存所有指标到other_metrics用于调试
-                    if metric_name and value != 0:
-                        financial_data['other_metrics'][f"第{idx+1}行_{metric_name}"] = value
-                
-                except:
-                    continue
+                status = 'completed'
             
+            finished_at = datetime.now()
+            self._update_job(job_id, {
+                'status': status,
+                'progress': 100,
+                'message': '上传完成' if status == 'completed' else '上传失败',
+                'result': result,
+                'finished_at': finished_at,
+                'elapsed_time': (finished_at - started_at).total_seconds()
+            })
         except Exception as e:
-            st.error(f"提取财务数据时出错: {e}")
-        
-        return financial_data
+            try:
+                self._update_job(job_id, {
+                    'status': 'failed',
+                    'message': '任务执行出错',
+                    'error': str(e),
+                    'finished_at': datetime.now()
+                })
+            except Exception:
+                pass
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """获取单个任务"""
+        return self.jobs_collection.find_one({'_id': job_id})
+    
+    def list_jobs(self, limit: int = 10) -> List[Dict]:
+        """获取最近提交的任务"""
+        return list(self.jobs_collection.find().sort('submitted_at', -1).limit(limit))
+    
+    def has_active_jobs(self) -> bool:
+        """本进程是否存在排队中或执行中的任务"""
+        return self.jobs_collection.count_documents(
+            {'status': {'$in': self.ACTIVE_STATUSES}, 'worker_id': self.worker_id}, limit=1
+        ) > 0
+
+@st.cache_resource
+def get_upload_job_manager():
+    db_manager = get_db_manager()
+    return UploadJobManager(db_manager.get_database())
 
 # 权限管理器
 class PermissionManager:
@@ -592,8 +1651,37 @@ class PermissionManager:
         self.permissions_collection = self.db['permissions']
         self.stores_collection = self.db['stores']
     
-    def upload_permission_table(self, uploaded_file) -> Dict:
-        """上传权限表"""
+    def resolve_query_code(self, query_code: str) -> Optional[Dict]:
+        """解析查询编号：一次$lookup聚合同时取得权限和门店，结果缓存在带有效期的登录缓存中
+        
+        查询编号无效时返回None；否则返回{'store': 门店文档}，门店不存在时store为None。
+        本进程内的权限变更会立即清除登录缓存，其他进程中的缓存最迟在有效期后失效。
+        """
+        login_cache = get_login_cache()
+        cached = login_cache.get(query_code)
+        if cached is not None:
+            return cached
+        
+        matches = list(self.permissions_collection.aggregate([
+            {'$match': {'query_code': query_code}},
+            {'$limit': 1},
+            {'$lookup': {'from': 'stores', 'localField': 'store_id', 'foreignField': '_id', 'as': 'stores'}},
+            {'$project': {'_id': 0, 'stores': 1}}
+        ]))
+        if not matches:
+            return None
+        
+        resolution = {'store': matches[0]['stores'][0] if matches[0]['stores'] else None}
+        if resolution['store'] is not None:
+            login_cache.set(query_code, resolution)
+        return resolution
+    
+    def upload_permission_table(self, uploaded_file, dry_run: bool = False) -> Dict:
+        """上传权限表
+        
+        dry_run=True时不写入数据库，只与已有权限比较，在results['diff']中列出将新建的门店，
+        以及将新建、更新和保持不变的查询编号。
+        """
         try:
             if uploaded_file.name.endswith('.csv'):
                 df = pd.read_csv(uploaded_file)
@@ -634,80 +1722,129 @@ class PermissionManager:
                     "store_name": str(store_name_col)
                 }
             }
+            if dry_run:
+                results["dry_run"] = True
+                results["unchanged"] = 0
+                results["diff"] = {"stores_to_create": [], "created": [], "updated": [], "unchanged": []}
             
-            for _, row in df.iterrows():
-                try:
-                    query_code = str(row[query_code_col]).strip()
-                    store_name = str(row[store_name_col]).strip()
-                    
-                    if not query_code or not store_name or query_code == 'nan' or store_name == 'nan':
-                        continue
-                    
-                    store = self._find_or_create_store(store_name)
+            # 整理有效行，同一查询编号出现多次时以最后一行为准
+            rows = {}
+            for query_code, store_name in zip(df[query_code_col].astype(str).str.strip(), df[store_name_col].astype(str).str.strip()):
+                if not query_code or not store_name or query_code == 'nan' or store_name == 'nan':
+                    continue
+                rows[query_code] = store_name
+            
+            if not rows:
+                return results
+            
+            # 预加载门店索引和已有权限，不再逐行查询数据库
+            store_index = StoreIndex.load(self.stores_collection)
+            existing_permissions = {}
+            query_codes = list(rows)
+            for start in range(0, len(query_codes), 1000):
+                for permission in self.permissions_collection.find(
+                    {'query_code': {'$in': query_codes[start:start + 1000]}},
+                    {'query_code': 1, 'store_id': 1, 'created_at': 1, 'created_by': 1}
+                ):
+                    existing_permissions[permission['query_code']] = permission
+            
+            operations = []
+            operation_codes = []
+            for query_code, store_name in rows.items():
+                if dry_run:
+                    existing = existing_permissions.get(query_code)
+                    store = store_index.find(store_name)
                     if not store:
-                        results["errors"].append(f"无法处理门店: {store_name}")
-                        continue
-                    
-                    existing = self.permissions_collection.find_one({'query_code': query_code})
-                    
-                    permission_doc = PermissionModel.create_permission_document(
-                        query_code=query_code,
-                        store_data=store,
-                        created_at=existing.get('created_at') if existing else None,
-                        created_by=existing.get('created_by', 'upload') if existing else 'upload'
-                    )
-                    
-                    if existing:
-                        self.permissions_collection.replace_one(
-                            {'query_code': query_code},
-                            permission_doc
-                        )
-                        results["updated"] += 1
+                        # 预览模式不创建门店，门店加入索引避免同名门店重复计数
+                        results["diff"]["stores_to_create"].append(store_name)
+                        store_index.add({'_id': None, 'store_name': store_name})
+                        action = "updated" if existing else "created"
+                    elif existing and existing.get('store_id') == store['_id']:
+                        action = "unchanged"
                     else:
-                        self.permissions_collection.insert_one(permission_doc)
-                        results["created"] += 1
-                    
-                    results["processed"] += 1
+                        action = "updated" if existing else "created"
+                    results[action] += 1
+                    results["diff"][action].append(query_code)
+                    continue
                 
+                try:
+                    store = self._find_or_create_store(store_name, store_index)
                 except Exception as e:
-                    results["errors"].append(f"处理行数据时出错: {str(e)}")
+                    results["errors"].append(f"无法处理门店 {store_name}: {e}")
+                    continue
+                
+                # 保留已有权限的创建时间和创建人
+                existing = existing_permissions.get(query_code)
+                permission_doc = PermissionModel.create_permission_document(
+                    query_code=query_code,
+                    store_data=store,
+                    created_at=existing.get('created_at') if existing else datetime.now(),
+                    created_by=existing.get('created_by', 'upload') if existing else 'upload'
+                )
+                operations.append(ReplaceOne({'query_code': query_code}, permission_doc, upsert=True))
+                operation_codes.append(query_code)
+            
+            if operations:
+                try:
+                    bulk_result = self.permissions_collection.bulk_write(operations, ordered=False)
+                    results["created"] = bulk_result.upserted_count
+                    results["updated"] = bulk_result.matched_count
+                except BulkWriteError as e:
+                    results["created"] = e.details.get('nUpserted', 0)
+                    results["updated"] = e.details.get('nMatched', 0)
+                    for error in e.details.get('writeErrors', []):
+                        results["errors"].append(f"写入查询编号 {operation_codes[error['index']]} 失败: {error.get('errmsg', '未知错误')}")
+                results["processed"] = results["created"] + results["updated"]
             
+            if dry_run:
+                results["processed"] = results["created"] + results["updated"] + results["unchanged"]
+            else:
+                get_login_cache().clear()
             return results
             
         except Exception as e:
             return {"success": False, "message": f"处理文件时出错: {str(e)}"}
     
-    def _find_or_create_store(self, store_name: str) -> Optional[Dict]:
-        """根据门店名称查找门店，如果不存在则创建"""
-        try:
-            # 精确匹配
-            store = self.stores_collection.find_one({'store_name': store_name})
+    def _find_or_create_store(self, store_name: str, store_index: Optional[StoreIndex] = None) -> Dict:
+        """根据门店名称查找门店，如果不存在则创建；提供store_index时只在内存索引中查找，新建门店同时加入索引
+        
+        查找或创建失败时抛出异常，由调用方记入上传结果
+        """
+        if store_index is not None:
+            store = store_index.find(store_name)
+            if not store:
+                store = StoreModel.create_store_document(
+                    store_name=store_name,
+                    created_by='permission_upload'
+                )
+                self.stores_collection.insert_one(store)
+                store_index.add(store)
+            return store
+        
+        # 精确匹配
+        store = self.stores_collection.find_one({'store_name': store_name})
+        if store:
+            return store
+        
+        # 按标准化名称和别名匹配
+        clean_name = StoreModel.normalize_store_name(store_name)
+        if clean_name:
+            store = self.stores_collection.find_one({
+                '$or': [
+                    {'normalized_name': clean_name.lower()},
+                    {'aliases': {'$in': [store_name, clean_name]}}
+                ]
+            })
             if store:
                 return store
-            
-            # 模糊匹配
-            clean_name = store_name.replace('犀牛百货', '').replace('门店', '').replace('店', '').strip()
-            if clean_name:
-                stores = list(self.stores_collection.find({
-                    '$or': [
-                        {'store_name': {'$regex': clean_name, '$options': 'i'}},
-                        {'aliases': {'$in': [store_name, clean_name]}}
-                    ]
-                }))
-                if stores:
-                    return stores[0]
-            
-            # 创建新门店
-            store_data = StoreModel.create_store_document(
-                store_name=store_name,
-                created_by='permission_upload'
-            )
-            self.stores_collection.insert_one(store_data)
-            return store_data
-            
-        except Exception as e:
-            st.error(f"查找门店时出错: {e}")
-            return None
+        
+        # 创建新门店
+        store_data = StoreModel.create_store_document(
+            store_name=store_name,
+            created_by='permission_upload'
+        )
+        self.stores_collection.insert_one(store_data)
+        return store_data
     
     def get_all_permissions(self) -> List[Dict]:
         """获取所有权限配置"""
@@ -717,31 +1854,77 @@ class PermissionManager:
             st.error(f"获取权限配置失败: {e}")
             return []
     
+    @staticmethod
+    def _prefix_filter(prefix: str = "") -> Dict:
+        """查询编号前缀过滤条件，使用锚定的正则表达式以便走query_code索引"""
+        return {'query_code': {'$regex': f"^{re.escape(prefix)}"}} if prefix else {}
+    
+    def count_permissions(self, prefix: str = "") -> int:
+        """统计查询编号以prefix开头的权限数量"""
+        try:
+            return self.permissions_collection.count_documents(self._prefix_filter(prefix))
+        except Exception as e:
+            st.error(f"统计权限配置失败: {e}")
+            return 0
+    
+    def search_permissions(self, prefix: str = "", skip: int = 0, limit: int = 50) -> List[Dict]:
+        """按查询编号排序分页获取以prefix开头的权限配置"""
+        try:
+            return list(
+                self.permissions_collection.find(
+                    self._prefix_filter(prefix),
+                    {'query_code': 1, 'store_name': 1, 'store_id': 1, 'store_code': 1, 'created_at': 1, 'updated_at': 1}
+                ).sort('query_code', 1).skip(skip).limit(limit)
+            )
+        except Exception as e:
+            st.error(f"获取权限配置失败: {e}")
+            return []
+    
+    def delete_permissions(self, query_codes: List[str]) -> int:
+        """批量删除权限配置，返回删除数量"""
+        try:
+            result = self.permissions_collection.delete_many({'query_code': {'$in': list(query_codes)}})
+            login_cache = get_login_cache()
+            for query_code in query_codes:
+                login_cache.invalidate(query_code)
+            return result.deleted_count
+        except Exception as e:
+            st.error(f"删除权限配置失败: {e}")
+            return 0
+    
     def delete_permission(self, query_code: str) -> bool:
         """删除权限配置"""
         try:
             result = self.permissions_collection.delete_one({'query_code': query_code})
+            get_login_cache().invalidate(query_code)
             return result.deleted_count > 0
         except Exception as e:
             st.error(f"删除权限配置失败: {e}")
             return False
 
 # 报表数据处理工具
-def rebuild_dataframe_with_headers(raw_data: List[Dict], headers: List[str]) -> pd.DataFrame:
-    """根据保存的表头重建DataFrame，解决表头消失问题，处理重复空白表头"""
+def rebuild_dataframe_with_headers(raw_data, headers: List[str]) -> pd.DataFrame:
+    """根据保存的表头重建DataFrame，解决表头消失问题，处理重复空白表头
+    
+    raw_data可以是逐行字典列表（旧格式），也可以是ReportModel.encode_columnar生成的列式结构。
+    """
     if not raw_data or not headers:
         return pd.DataFrame()
     
     try:
-        # 重建数据矩阵
-        data_matrix = []
-        for row_data in raw_data:
-            row_values = []
-            for col_idx in range(len(headers)):
-                col_key = f"col_{col_idx}"
-                value = row_data.get(col_key, "")
-                row_values.append(value)
-            data_matrix.append(row_values)
+        if isinstance(raw_data, dict):
+            columns = ReportModel.decode_columnar(raw_data, len(headers))
+        else:
+            # 重建数据矩阵
+            data_matrix = []
+            for row_data in raw_data:
+                row_values = []
+                for col_idx in range(len(headers)):
+                    col_key = f"col_{col_idx}"
+                    value = row_data.get(col_key, "")
+                    row_values.append(value)
+                data_matrix.append(row_values)
+            columns = None
         
         # 处理重复的空白表头，创建唯一的pandas列名
         unique_headers = []
@@ -757,7 +1940,11 @@ def rebuild_dataframe_with_headers(raw_data: List[Dict], headers: List[str]) ->
                 unique_headers.append(header)
         
         # 使用唯一表头创建DataFrame
-        df = pd.DataFrame(data_matrix, columns=unique_headers)
+        if columns is not None:
+            df = pd.DataFrame(dict(zip(range(len(columns)), columns)))
+            df.columns = unique_headers
+        else:
+            df = pd.DataFrame(data_matrix, columns=unique_headers)
         
         # 将显示用的表头存储为属性
         df.attrs['display_headers'] = display_headers
@@ -768,6 +1955,214 @@ def rebuild_dataframe_with_headers(raw_data: List[Dict], headers: List[str]) ->
         st.error(f"重建表格失败: {e}")
         return pd.DataFrame()
 
+def format_amounts(numbers: np.ndarray) -> List[str]:
+    """将数值数组格式化为两位小数和千分位文本，结果与f"{value:,.2f}"逐个格式化一致
+    
+    map直接调用内置format，每个值不经过Python层的函数调用和异常处理。
+    """
+    return list(map(format, np.asarray(numbers, dtype=float).tolist(), itertools.repeat(',.2f')))
+
+def format_numeric_columns(df: pd.DataFrame, numeric_ratio: float = 0.3) -> pd.DataFrame:
+    """格式化数字列：超过30%的值是数字的列格式化为两位小数和千分位，返回新的DataFrame
+    
+    整表只做一次数值转换，数字列中能转换为数字的值整体格式化，其余值保留原文本（空值为空字符串）。
+    """
+    display_df = df.copy()
+    if df.empty:
+        return display_df
+    
+    try:
+        values = df.to_numpy(dtype=object)
+        numeric_matrix = to_numeric_matrix(df)
+        is_number = ~np.isnan(numeric_matrix)
+    except Exception:
+        # 如果转换失败，保持原样
+        return display_df
+    
+    # 如果超过30%的值是数字，就格式化这一列
+    for col_idx in np.flatnonzero(is_number.sum(axis=0) > len(df) * numeric_ratio):
+        number_mask = is_number[:, col_idx]
+        formatted_values = np.empty(len(df), dtype=object)
+        formatted_values[number_mask] = format_amounts(numeric_matrix[number_mask, col_idx])
+        
+        # 无法转换为数字的值保留原文本
+        others = values[~number_mask, col_idx]
+        formatted_values[~number_mask] = np.where(pd.isna(others), "", others.astype(str)).astype(object)
+        display_df[df.columns[col_idx]] = formatted_values
+    
+    return display_df
+
+# 报表表格每页行数选项
+TABLE_PAGE_SIZE_OPTIONS = [50, 100, 200, 500]
+
+def render_table_rows_html(display_df: pd.DataFrame, display_headers: List[str]) -> Dict:
+    """渲染报表表格的表头行和每个数据行的HTML，分页时按行切片拼接，不必重新渲染
+    
+    一次取出数值矩阵后拼接，不逐单元格定位；values按整表公共类型取值，与按行读取时的取值一致。
+    """
+    header_parts = ["<tr style='background-color: #f0f0f0;'>"]
+    for header in display_headers:
+        if header == "":
+            header_parts.append("<th style='padding: 8px; text-align: center; min-width: 100px;'>&nbsp;</th>")
+        else:
+            header_parts.append(f"<th style='padding: 8px; text-align: center;'>{header}</th>")
+    header_parts.append("</tr>")
+    
+    rows = [
+        "<tr>" + "".join(f"<td style='padding: 8px; text-align: center;'>{value}</td>" for value in row) + "</tr>"
+        for row in display_df.values
+    ]
+    return {'header': "".join(header_parts), 'rows': rows}
+
+def render_report_table_html(table_html: Dict, start: int = 0, stop: int = None) -> str:
+    """拼接表头和指定范围的数据行，生成完整的HTML表格"""
+    return (
+        "<div style='overflow-x: auto;'><table border='1' style='border-collapse: collapse; width: 100%;'>"
+        + table_html['header']
+        + "".join(table_html['rows'][start:stop])
+        + "</table></div>"
+    )
+
+def build_report_excel(df: pd.DataFrame, sheet_name: str) -> bytes:
+    """生成报表Excel文件：第一行为原始显示表头（空白表头保持空白），其余为报表数据
+    
+    安装了xlsxwriter时以constant_memory模式逐行写入，否则使用openpyxl。
+    """
+    display_headers = df.attrs.get('display_headers', df.columns.tolist())
+    buffer = io.BytesIO()
+    
+    try:
+        if XLSXWRITER_AVAILABLE:
+            workbook = xlsxwriter.Workbook(buffer, {
+                'constant_memory': True,
+                'nan_inf_to_errors': True,
+                'strings_to_formulas': False,
+                'strings_to_urls': False
+            })
+            worksheet = workbook.add_worksheet(sheet_name)
+            header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+            worksheet.write_row(0, 0, display_headers, header_format)
+            for row_idx, row in enumerate(df.values.tolist(), start=1):
+                worksheet.write_row(row_idx, 0, row)
+            workbook.close()
+        else:
+            # 使用pandas的ExcelWriter，空白列名先用临时列名占位，写入后再改回空白
+            temp_df = df.copy()
+            temp_df.columns = [header if header != "" else f"_col_{i}" for i, header in enumerate(display_headers)]
+            
+            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+                temp_df.to_excel(writer, index=False, sheet_name=sheet_name)
+                worksheet = writer.sheets[sheet_name]
+                for col_idx, header in enumerate(display_headers):
+                    if header == "":
+                        worksheet.cell(row=1, column=col_idx + 1).value = ""
+    except Exception as e:
+        st.error(f"Excel生成错误: {e}")
+        # fallback: 使用简化方式
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+    
+    return buffer.getvalue()
+
+def get_report_months(db, store_id: str) -> List[str]:
+    """获取门店有报表的月份列表（由新到旧），只投影report_month，可由(store_id, report_month)索引直接覆盖"""
+    months = []
+    for report in db['reports'].find({'store_id': store_id}, {'_id': 0, 'report_month': 1}).sort('report_month', -1):
+        if not months or months[-1] != report['report_month']:
+            months.append(report['report_month'])
+    return months
+
+def get_report_summary(db, store_id: str, report_month: str) -> Optional[Dict]:
+    """获取门店指定月份的报表摘要；摘要缺失时（如历史数据尚未回填）从报表重建并保存"""
+    summary = db['report_summaries'].find_one({'store_id': store_id, 'report_month': report_month})
+    if summary:
+        return summary
+    
+    report = db['reports'].find_one(
+        {'store_id': store_id, 'report_month': report_month},
+        {'raw_excel_data': 0, 'table_headers': 0},
+        sort=[('updated_at', -1)]
+    )
+    if not report:
+        return None
+    
+    summary = ReportModel.create_summary_document(report)
+    try:
+        db['report_summaries'].replace_one(
+            {'store_id': store_id, 'report_month': summary['report_month']},
+            summary,
+            upsert=True
+        )
+    except Exception:
+        pass
+    return summary
+
+def get_receivable_history(db, store_id: str, report_months: List[str] = None) -> List[Dict]:
+    """按月份获取门店应收未收金额历史，只聚合报表摘要字段，走(store_id, report_month)索引
+    
+    提供report_months时，缺少摘要的月份从报表重建摘要后补齐。
+    """
+    history = list(db['report_summaries'].aggregate([
+        {'$match': {'store_id': store_id}},
+        {'$sort': {'report_month': 1}},
+        {'$project': {'_id': 0, 'report_month': 1, 'net_amount': 1, 'extraction_status': 1}}
+    ]))
+    
+    if report_months:
+        known_months = {item['report_month'] for item in history}
+        missing_months = [month for month in report_months if month not in known_months]
+        for month in missing_months:
+            summary = get_report_summary(db, store_id, month)
+            if summary:
+                history.append({key: summary.get(key) for key in ('report_month', 'net_amount', 'extraction_status')})
+        if missing_months:
+            history.sort(key=lambda item: item['report_month'])
+    
+    return history
+
+def build_receivable_history_chart(history: List[Dict]) -> go.Figure:
+    """绘制应收未收金额趋势图：正数为门店应返，负数为总部应退，与看板配色一致"""
+    months = [item['report_month'] for item in history]
+    amounts = [item.get('net_amount') or 0 for item in history]
+    colors = ['#FF8F00' if amount > 0 else '#3F51B5' if amount < 0 else '#78909C' for amount in amounts]
+    labels = ['门店应返' if amount > 0 else '总部应退' if amount < 0 else '已结清' for amount in amounts]
+    
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=months,
+        y=amounts,
+        marker_color=colors,
+        customdata=labels,
+        hovertemplate="%{x}<br>%{customdata}: ¥%{y:,.2f}<extra></extra>",
+        name="应收未收金额"
+    ))
+    fig.add_trace(go.Scatter(
+        x=months,
+        y=amounts,
+        mode='lines+markers',
+        line=dict(color='#546E7A', width=2),
+        hoverinfo='skip',
+        showlegend=False
+    ))
+    fig.update_layout(
+        xaxis=dict(type='category', title="报表月份"),
+        yaxis=dict(title="金额 (¥)", tickformat=",.2f"),
+        showlegend=False,
+        height=360,
+        margin=dict(l=20, r=20, t=20, b=20)
+    )
+    return fig
+
+def load_report_for_display(db, summary: Dict) -> Optional[Dict]:
+    """按摘要读取显示表格所需的报表字段"""
+    report_projection = {'report_month': 1, 'raw_excel_data': 1, 'table_headers': 1}
+    return db['reports'].find_one({'_id': summary['report_id']}, report_projection) or db['reports'].find_one(
+        {'store_id': summary['store_id'], 'report_month': summary['report_month']},
+        report_projection,
+        sort=[('updated_at', -1)]
+    )
+
 # 应用界面
 def create_query_app():
     """门店查询应用"""
@@ -796,9 +2191,9 @@ def create_query_app():
             if st.button("登录", use_container_width=True):
                 if query_code:
                     try:
-                        permission = db['permissions'].find_one({'query_code': query_code})
-                        if permission:
-                            store = db['stores'].find_one({'_id': permission['store_id']})
+                        resolution = PermissionManager(db).resolve_query_code(query_code)
+                        if resolution:
+                            store = resolution['store']
                             if store:
                                 st.session_state.authenticated = True
                                 st.session_state.store_info = store
@@ -827,14 +2222,29 @@ def create_query_app():
         
         # 获取报表数据
         try:
-            reports = list(db['reports'].find({'store_id': store_info['_id']}).sort('report_month', -1))
+            report_cache = get_report_cache()
+            data_versions = DataVersionManager.get_versions(db)
+            
+            report_months = report_cache.get_or_load(
+                ('months', store_info['_id'], data_versions.get(DataVersionManager.GLOBAL_KEY, 0)),
+                lambda: get_report_months(db, store_info['_id'])
+            )
+            
+            summary = None
+            if report_months:
+                # 默认显示最新月份，历史月份按需加载
+                with st.sidebar:
+                    selected_month = st.selectbox("报表月份", report_months, index=0)
+                month_version = data_versions.get(DataVersionManager.month_key(selected_month), 0)
+                summary = report_cache.get_or_load(
+                    ('summary', store_info['_id'], selected_month, month_version),
+                    lambda: get_report_summary(db, store_info['_id'], selected_month)
+                )
             
-            if reports:
+            if summary:
                 # 美化的应收未收看板
                 try:
-                    latest_report = reports[0]
-                    receivables = latest_report.get('financial_data', {}).get('receivables', {})
-                    amount = receivables.get('net_amount', 0)
+                    amount = summary.get('net_amount') or 0
                     
                     # 添加自定义CSS样式
                     if amount < 0:
@@ -972,51 +2382,45 @@ def create_query_app():
                     </div>
                     """, unsafe_allow_html=True)
                 
+                # 历史应收趋势
+                if len(report_months) > 1:
+                    st.subheader("📈 历史应收趋势")
+                    try:
+                        history = report_cache.get_or_load(
+                            ('history', store_info['_id'], data_versions.get(DataVersionManager.GLOBAL_KEY, 0)),
+                            lambda: get_receivable_history(db, store_info['_id'], report_months)
+                        )
+                        st.plotly_chart(build_receivable_history_chart(history), use_container_width=True)
+                    except Exception as e:
+                        st.error(f"获取历史趋势失败: {e}")
+                
                 # 报表数据展示 - 修复表头问题
                 st.subheader("报表数据")
                 
+                latest_report = {}
                 try:
-                    latest_report = reports[0]
+                    # 只在显示表格时读取完整报表，报表、重建的DataFrame和格式化结果按数据版本缓存
+                    report_cache_key = (store_info['_id'], summary['report_month'], month_version)
+                    latest_report = report_cache.get_or_load(
+                        ('report',) + report_cache_key,
+                        lambda: load_report_for_display(db, summary)
+                    ) or {}
                     raw_data = latest_report.get('raw_excel_data', [])
                     headers = latest_report.get('table_headers', [])
                     
                     if raw_data and headers:
                         # 使用保存的表头重建DataFrame
-                        df = rebuild_dataframe_with_headers(raw_data, headers)
+                        df = report_cache.get_or_load(
+                            ('dataframe',) + report_cache_key,
+                            lambda: rebuild_dataframe_with_headers(raw_data, headers)
+                        )
                         
                         if not df.empty:
                             # 格式化数字列：两位小数和千分位
-                            df_display = df.copy()
-                            
-                            # 获取原始显示表头
-                            display_headers = df.attrs.get('display_headers', df.columns.tolist())
-                            
-                            # 为显示创建新的DataFrame，使用原始表头但要处理重复问题
-                            display_df = df_display.copy()
-                            
-                            # 格式化数字列
-                            for col in df_display.columns:
-                                # 尝试将每列转换为数字并格式化
-                                try:
-                                    # 检查列是否包含数字
-                                    numeric_series = pd.to_numeric(df_display[col], errors='coerce')
-                                    # 如果超过30%的值是数字，就格式化这一列
-                                    if numeric_series.notna().sum() > len(df_display) * 0.3:
-                                        # 格式化数字列
-                                        formatted_values = []
-                                        for i, val in enumerate(df_display[col]):
-                                            try:
-                                                num_val = pd.to_numeric(val, errors='coerce')
-                                                if pd.notna(num_val):
-                                                    formatted_values.append(f"{num_val:,.2f}")
-                                                else:
-                                                    formatted_values.append(str(val) if pd.notna(val) else "")
-                                            except:
-                                                formatted_values.append(str(val) if pd.notna(val) else "")
-                                        display_df[col] = formatted_values
-                                except:
-                                    # 如果转换失败，保持原样
-                                    continue
+                            display_df = report_cache.get_or_load(
+                                ('display',) + report_cache_key,
+                                lambda: format_numeric_columns(df)
+                            )
                             
                             # 显示格式化后的只读表格
                             # 为了正确显示空白列名，使用st.table而不是st.dataframe
@@ -1024,79 +2428,51 @@ def create_query_app():
                             # 获取原始显示表头
                             display_headers = df.attrs.get('display_headers', df.columns.tolist())
                             
-                            # 创建用于显示的HTML表格
-                            html_table = "<div style='overflow-x: auto;'><table border='1' style='border-collapse: collapse; width: 100%;'>"
-                            
-                            # 添加表头行
-                            html_table += "<tr style='background-color: #f0f0f0;'>"
-                            for header in display_headers:
-                                if header == "":
-                                    html_table += "<th style='padding: 8px; text-align: center; min-width: 100px;'>&nbsp;</th>"
-                                else:
-                                    html_table += f"<th style='padding: 8px; text-align: center;'>{header}</th>"
-                            html_table += "</tr>"
-                            
-                            # 添加数据行（最多显示100行）
-                            max_rows = min(100, len(display_df))
-                            for i in range(max_rows):
-                                html_table += "<tr>"
-                                for col in display_df.columns:
-                                    value = display_df.iloc[i][col]
-                                    html_table += f"<td style='padding: 8px; text-align: center;'>{value}</td>"
-                                html_table += "</tr>"
+                            # 创建用于显示的HTML表格，同一报表内容只渲染一次，翻页时只切片拼接
+                            table_html = report_cache.get_or_load(
+                                ('table_html', summary['report_id'], summary.get('content_hash')),
+                                lambda: render_table_rows_html(display_df, display_headers)
+                            )
                             
-                            html_table += "</table></div>"
+                            total_rows = len(table_html['rows'])
+                            page_start, page_stop = 0, total_rows
+                            if total_rows > TABLE_PAGE_SIZE_OPTIONS[0]:
+                                col_page_size, col_page = st.columns(2)
+                                with col_page_size:
+                                    page_size = st.selectbox("每页行数", TABLE_PAGE_SIZE_OPTIONS, index=1, key="table_page_size")
+                                page_count = (total_rows + page_size - 1) // page_size
+                                with col_page:
+                                    page = st.number_input(
+                                        f"页码（共{page_count}页）",
+                                        min_value=1,
+                                        max_value=page_count,
+                                        value=1,
+                                        key=f"table_page_{summary['report_id']}_{page_size}"
+                                    )
+                                page_start = (int(page) - 1) * page_size
+                                page_stop = min(page_start + page_size, total_rows)
                             
                             # 显示HTML表格
-                            st.markdown(html_table, unsafe_allow_html=True)
+                            st.markdown(render_report_table_html(table_html, page_start, page_stop), unsafe_allow_html=True)
                             
-                            # 如果数据超过100行，显示提示
-                            if len(display_df) > 100:
-                                st.info(f"表格显示前100行，完整数据共{len(display_df)}行。请下载Excel查看完整数据。")
+                            if page_stop - page_start < total_rows:
+                                st.caption(f"显示第 {page_start + 1}-{page_stop} 行，共 {total_rows} 行")
                             
-                            # 提供Excel下载功能
-                            buffer = io.BytesIO()
-                            try:
-                                # 为Excel下载创建带有原始表头的DataFrame
-                                download_df = df.copy()
-                                display_headers = df.attrs.get('display_headers', df.columns.tolist())
-                                
-                                # 使用pandas的ExcelWriter，但处理空白列名
-                                excel_headers = []
-                                for i, header in enumerate(display_headers):
-                                    if header == "":
-                                        excel_headers.append(f"_col_{i}")  # 临时列名
-                                    else:
-                                        excel_headers.append(header)
-                                
-                                # 创建临时DataFrame用于导出
-                                temp_df = download_df.copy()
-                                temp_df.columns = excel_headers
-                                
-                                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                                    temp_df.to_excel(writer, index=False, sheet_name=store_info['store_name'][:31])
-                                    
-                                    # 获取工作簿和工作表
-                                    workbook = writer.book
-                                    worksheet = writer.sheets[store_info['store_name'][:31]]
-                                    
-                                    # 手动设置表头为空白（如果原来是空的）
-                                    for col_idx, (original_header, excel_header) in enumerate(zip(display_headers, excel_headers)):
-                                        if original_header == "":
-                                            # 设置表头单元格为空白
-                                            worksheet.cell(row=1, column=col_idx + 1).value = ""
-                            except Exception as e:
-                                st.error(f"Excel生成错误: {e}")
-                                # fallback: 使用简化方式
-                                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                                    df.to_excel(writer, index=False, sheet_name=store_info['store_name'][:31])
+                            # 提供Excel下载功能：点击生成后才构建文件，同一报表内容只生成一次
+                            excel_cache_key = ('excel', summary['report_id'], summary.get('content_hash'))
+                            excel_bytes = report_cache.get(excel_cache_key)
+                            if excel_bytes is None and st.button("📄 生成Excel文件"):
+                                with st.spinner("正在生成Excel文件..."):
+                                    excel_bytes = build_report_excel(df, store_info['store_name'][:31])
+                                report_cache.set(excel_cache_key, excel_bytes)
                             
-                            st.download_button(
-                                label="📥 下载完整报表 (Excel)",
-                                data=buffer.getvalue(),
-                                file_name=f"{store_info['store_name']}_{latest_report['report_month']}_报表.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                            )
+                            if excel_bytes is not None:
+                                st.download_button(
+                                    label="📥 下载完整报表 (Excel)",
+                                    data=excel_bytes,
+                                    file_name=f"{store_info['store_name']}_{latest_report['report_month']}_报表.xlsx",
+                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                                )
                         else:
                             st.info("报表数据格式错误")
                     else:
@@ -1107,13 +2483,264 @@ def create_query_app():
                     
                     # 显示调试信息
                     with st.expander("调试信息"):
-                        st.write("原始数据预览:", latest_report.get('raw_excel_data', [])[:5])
+                        raw_preview = latest_report.get('raw_excel_data', [])
+                        if isinstance(raw_preview, dict):
+                            raw_preview = {key: value for key, value in raw_preview.items() if key != 'columns'}
+                        else:
+                            raw_preview = raw_preview[:5]
+                        st.write("原始数据预览:", raw_preview)
                         st.write("表头信息:", latest_report.get('table_headers', []))
             else:
                 st.info("暂无报表数据")
         except Exception as e:
             st.error(f"查询报表失败: {e}")
 
+def render_deduplication_migration(db_manager: DatabaseManager):
+    """去重迁移：列出重复记录，管理员确认后每组保留最近更新的一条并创建唯一索引"""
+    for collection_name, conflict in list(db_manager.index_conflicts.items()):
+        st.markdown(f"**去重迁移：{collection_name}（{conflict['index']}）**")
+        st.dataframe(pd.DataFrame([
+            dict(duplicate['key'], 记录数=duplicate['count'], 保留=str(duplicate['ids'][0]), 删除=', '.join(map(str, duplicate['ids'][1:])))
+            for duplicate in conflict['duplicates']
+        ]), use_container_width=True, hide_index=True)
+        
+        confirmed = st.checkbox(
+            f"我已核对以上记录，确认删除 {collection_name} 中的重复记录（每组保留最近更新的一条，删除后无法恢复）",
+            key=f"confirm_dedupe_{collection_name}"
+        )
+        if st.button("执行去重并创建唯一索引", key=f"dedupe_{collection_name}", disabled=not confirmed, type="primary"):
+            with st.spinner("正在去重..."):
+                deleted_count = db_manager.deduplicate(collection_name)
+            if collection_name in db_manager.index_conflicts:
+                st.warning(f"已删除 {deleted_count} 条重复记录，但仍存在重复数据，请重新核对")
+            else:
+                st.success(f"已删除 {deleted_count} 条重复记录，唯一索引已创建")
+
+def render_connection_diagnostics(db_manager: DatabaseManager):
+    """显示数据库连接诊断：客户端配置、连接池借出与等待时间、各命令耗时和索引检查"""
+    snapshot = db_manager.monitor.snapshot()
+    pool = snapshot['pool']
+    
+    st.caption(f"统计自 {snapshot['started_at'].strftime('%Y-%m-%d %H:%M:%S')} 起")
+    st.json(db_manager.client_options, expanded=False)
+    
+    col_open, col_checked_out, col_checkouts, col_failures = st.columns(4)
+    with col_open:
+        st.metric("打开连接", pool['open_connections'])
+    with col_checked_out:
+        st.metric("借出中", pool['checked_out'], help=f"峰值 {pool['max_checked_out']}")
+    with col_checkouts:
+        st.metric("借出次数", pool['checkouts'])
+    with col_failures:
+        st.metric("借出失败", pool['checkout_failures'])
+    
+    col_p50, col_p95, col_max, col_cleared = st.columns(4)
+    with col_p50:
+        st.metric("等待 P50", f"{pool['wait_p50_ms']:.2f}ms")
+    with col_p95:
+        st.metric("等待 P95", f"{pool['wait_p95_ms']:.2f}ms")
+    with col_max:
+        st.metric("等待最大", f"{pool['wait_max_ms']:.2f}ms")
+    with col_cleared:
+        st.metric("连接池清空", pool['pool_cleared'])
+    
+    for reason, count in snapshot['checkout_failure_reasons'].items():
+        st.write(f"• 借出失败 {reason}: {count} 次")
+    
+    if snapshot['commands']:
+        commands_df = pd.DataFrame(snapshot['commands']).rename(columns={
+            'command': '命令',
+            'count': '次数',
+            'failed': '失败',
+            'avg_ms': '平均(ms)',
+            'p50_ms': 'P50(ms)',
+            'p95_ms': 'P95(ms)',
+            'max_ms': '最大(ms)',
+            'total_ms': '累计(ms)'
+        })
+        st.dataframe(commands_df.round(2), use_container_width=True, hide_index=True)
+    else:
+        st.info("暂无命令记录")
+    
+    if st.button("重置统计", key="reset_connection_diagnostics"):
+        db_manager.monitor.reset()
+        st.rerun()
+    
+    st.markdown("**索引检查**")
+    if st.button("重新检查索引", key="recheck_indexes"):
+        db_manager.ensure_unique_indexes()
+    index_report = db_manager.index_report
+    if index_report is None:
+        st.info("尚未检查索引")
+        return
+    
+    st.caption(f"检查时间 {index_report['checked_at'].strftime('%Y-%m-%d %H:%M:%S')}")
+    if index_report['missing']:
+        st.warning(f"⚠️ 缺失 {len(index_report['missing'])} 个计划中的索引")
+        st.dataframe(pd.DataFrame(index_report['missing']), use_container_width=True, hide_index=True)
+    else:
+        st.success("✅ 索引计划中的索引均已创建")
+    if index_report['conflicts']:
+        st.error("❌ 以下集合存在重复数据，未创建唯一索引（不会自动删除数据）")
+        st.dataframe(pd.DataFrame(index_report['conflicts']), use_container_width=True, hide_index=True)
+        render_deduplication_migration(db_manager)
+    if index_report['unused']:
+        st.info(f"ℹ️ 自统计开始以来未被使用的索引 {len(index_report['unused'])} 个（mongod重启后计数清零）")
+        st.dataframe(pd.DataFrame(index_report['unused']), use_container_width=True, hide_index=True)
+    for error in index_report['errors']:
+        st.caption(f"无法检查: {error}")
+
+def render_dry_run_diff(diff: Dict[str, List], labels: Dict[str, str]):
+    """显示预览模式的变更列表，labels为diff键到显示名称的映射"""
+    columns = st.columns(len(labels))
+    for column, (key, label) in zip(columns, labels.items()):
+        with column:
+            st.metric(label, len(diff.get(key, [])))
+    
+    for key, label in labels.items():
+        items = diff.get(key, [])
+        if items:
+            with st.expander(f"{label}（{len(items)}）"):
+                st.dataframe(pd.DataFrame({label: [str(item) for item in items]}), use_container_width=True, hide_index=True)
+
+def render_upload_result(result: Dict, db, report_month: str, incremental: bool = False):
+    """显示上传结果"""
+    # 结果统计
+    col_cleared, col_success, col_failed, col_time = st.columns(4)
+    with col_cleared:
+        st.metric("🗑️ 清理历史", result['cleared_count'])
+    with col_success:
+        st.metric("✅ 成功上传", result['success_count'])
+    with col_failed:
+        st.metric("❌ 失败数量", result['failed_count'])
+    with col_time:
+        st.metric("⏱️ 总耗时", f"{result['total_time']:.2f}s")
+        st.caption(f"其中解析Excel: {result.get('parse_time', 0):.2f}s")
+    
+    if incremental:
+        col_unchanged, col_updated, col_inserted, col_removed = st.columns(4)
+        with col_unchanged:
+            st.metric("⏸️ 未变化", result['unchanged_count'])
+        with col_updated:
+            st.metric("🔄 已更新", result['updated_count'])
+        with col_inserted:
+            st.metric("🆕 新增门店", result['inserted_count'])
+        with col_removed:
+            st.metric("➖ 已移除", result['removed_count'])
+    
+    # 成功信息
+    if result['success_count'] > 0:
+        st.success(f"✅ 成功处理 {result['success_count']} 个门店的数据")
+        
+        if result['processed_stores']:
+            with st.expander("查看成功上传的门店"):
+                success_df = pd.DataFrame(result['processed_stores'])
+                st.dataframe(success_df, use_container_width=True)
+        
+        # 显示应收未收金额提取调试信息
+        with st.expander("🔧 应收金额提取调试信息"):
+            try:
+                # 获取一个示例报表的调试信息
+                sample_report = db['reports'].find_one({'report_month': report_month})
+                if sample_report:
+                    debug_info = sample_report.get('financial_data', {}).get('other_metrics', {})
+                    if debug_info:
+                        for key, value in debug_info.items():
+                            st.write(f"**{key}:** {value}")
+                    else:
+                        st.write("无调试信息")
+                    
+                    # 显示表头处理信息
+                    headers = sample_report.get('table_headers', [])
+                    st.write("**处理后的表头:**")
+                    for i, h in enumerate(headers):
+                        if h == "":
+                            st.write(f"列 {i}: [空白] (长度: {len(h)})")
+                        else:
+                            st.write(f"列 {i}: '{h}' (长度: {len(h)})")
+                else:
+                    st.write("未找到报表数据")
+            except Exception as e:
+                st.write(f"获取调试信息失败: {e}")
+    
+    # 失败信息
+    if result['failed_count'] > 0:
+        st.error(f"❌ {result['failed_count']} 个门店上传失败")
+        
+        if result['failed_stores']:
+            with st.expander("查看失败详情"):
+                failed_df = pd.DataFrame(result['failed_stores'])
+                st.dataframe(failed_df, use_container_width=True)
+    
+    # 错误信息
+    if result['errors']:
+        with st.expander("查看错误详情"):
+            for error in result['errors']:
+                st.error(error)
+
+def render_upload_jobs(job_manager: 'UploadJobManager', db):
+    """显示最近的上传任务及其进度"""
+    status_labels = {
+        'queued': '⏳ 排队中',
+        'running': '🔄 处理中',
+        'completed': '✅ 已完成',
+        'failed': '❌ 失败',
+        'interrupted': '⚠️ 已中断'
+    }
+    
+    try:
+        jobs = job_manager.list_jobs(limit=10)
+    except Exception as e:
+        st.error(f"获取上传任务失败: {e}")
+        return
+    
+    if not jobs:
+        st.info("暂无上传任务")
+        return
+    
+    finished_jobs = []
+    for job in jobs:
+        status = job.get('status', 'queued')
+        submitted_at = job.get('submitted_at')
+        submitted_text = submitted_at.strftime('%m-%d %H:%M:%S') if submitted_at else ''
+        
+        st.write(f"**{status_labels.get(status, status)}** | {job.get('file_name', '')} | {job.get('report_month', '')} | {submitted_text}")
+        if status in UploadJobManager.ACTIVE_STATUSES:
+            st.progress(min(max(job.get('progress', 0), 0), 100) / 100)
+            st.caption(job.get('message', ''))
+            continue
+        
+        if job.get('error'):
+            st.caption(f"任务执行出错: {job['error']}")
+        elif status == 'interrupted':
+            st.caption(job.get('message', '任务已中断'))
+        elif job.get('result'):
+            result = job['result']
+            st.caption(f"成功 {result['success_count']} | 失败 {result['failed_count']} | 耗时 {job.get('elapsed_time', result['total_time']):.2f}s")
+        
+        if job.get('result'):
+            finished_jobs.append(job)
+    
+    if finished_jobs:
+        st.subheader("📊 上传结果")
+        jobs_by_id = {job['_id']: job for job in finished_jobs}
+        selected_job_id = st.selectbox(
+            "选择任务",
+            list(jobs_by_id),
+            format_func=lambda job_id: f"{jobs_by_id[job_id].get('file_name', '')} ({jobs_by_id[job_id].get('report_month', '')}, {job_id})"
+        )
+        selected_job = jobs_by_id[selected_job_id]
+        render_upload_result(
+            selected_job['result'], db, selected_job.get('report_month', ''),
+            incremental=selected_job.get('options', {}).get('incremental', False)
+        )
+
+def poll_upload_jobs(job_manager: 'UploadJobManager', db):
+    """定时刷新的任务列表，所有任务结束后整页重跑一次以停止轮询"""
+    render_upload_jobs(job_manager, db)
+    if not job_manager.has_active_jobs():
+        st.rerun()
+
 def create_upload_app():
     """批量上传应用"""
     st.title("📤 批量上传系统")
@@ -1146,7 +2773,7 @@ def create_upload_app():
     db = db_manager.get_database()
     
     try:
-        uploader = BulkReportUploader(db)
+        job_manager = get_upload_job_manager()
         
         col1, col2 = st.columns([2, 1])
         
@@ -1160,16 +2787,47 @@ def create_upload_app():
                 help="格式：YYYY-MM，例如：2024-12"
             )
             
+            # 增量更新选项
+            incremental = st.checkbox(
+                "🔁 增量更新",
+                value=False,
+                help="勾选后只改写内容有变化的门店、新增新门店，并删除文件中已不存在的门店，内容未变化的门店不重复写入"
+            )
+            
             # 清除历史数据选项
             clear_history = st.checkbox(
                 "🗑️ 完全覆盖历史数据", 
                 value=True,
+                disabled=incremental,
                 help="勾选后将清除该月份的所有历史数据，确保数据一致性"
             )
             
-            if clear_history:
+            if incremental:
+                st.info("ℹ️ 增量更新：该月份数据将与上传文件保持一致，仅写入有变化的门店")
+            elif clear_history:
                 st.warning("⚠️ 将清除该月份所有历史数据，上传的新文件将完全替换旧数据")
             
+            with st.expander("⚙️ 高级设置"):
+                batch_size = st.number_input(
+                    "批量写入大小",
+                    min_value=1,
+                    max_value=1000,
+                    value=100,
+                    help="每批写入数据库的报表数量，远程数据库可适当调大以减少网络往返"
+                )
+                max_workers = st.number_input(
+                    "并行进程数",
+                    min_value=1,
+                    max_value=os.cpu_count() or 1,
+                    value=1,
+                    help="大于1时使用多进程并行转换工作表，门店匹配和数据库写入仍在主进程中执行；子进程启动需要数秒，工作表较多时才有收益"
+                )
+                streaming = st.checkbox(
+                    "流式处理（超大文件）",
+                    value=False,
+                    help="逐个工作表读取、转换并写入，内存占用不随工作表数量增长，适用于年终合并等超大文件"
+                )
+            
             # 文件上传
             uploaded_file = st.file_uploader(
                 "选择Excel文件",
@@ -1178,89 +2836,60 @@ def create_upload_app():
             )
             
             if uploaded_file and report_month:
+                if st.button("🔍 预览变更", use_container_width=True, help="只比较不写入：列出将新建的门店以及将新增、更新、保持不变和移除的报表"):
+                    with st.spinner("正在比较上传文件与已有报表..."):
+                        preview = BulkReportUploader(db).process_excel_file(
+                            io.BytesIO(uploaded_file.getvalue()),
+                            report_month,
+                            clear_history=clear_history,
+                            max_workers=int(max_workers),
+                            streaming=streaming,
+                            incremental=incremental,
+                            dry_run=True
+                        )
+                    if clear_history and not incremental:
+                        st.warning(f"⚠️ 上传时将先清除该月份 {preview['cleared_count']} 条历史报表")
+                    render_dry_run_diff(preview['diff'], {
+                        'stores_to_create': "🏪 新建门店",
+                        'inserted': "🆕 新增报表",
+                        'updated': "🔄 更新报表",
+                        'unchanged': "⏸️ 未变化",
+                        'removed': "➖ 移除报表"
+                    })
+                    for failed_store in preview['failed_stores']:
+                        st.write(f"• {failed_store['store_name']}: {failed_store['reason']}")
+                    for error in preview['errors']:
+                        st.error(error)
+                
                 if st.button("开始上传", type="primary", use_container_width=True):
-                    # 进度显示
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    def update_progress(progress, message):
-                        progress_bar.progress(progress / 100)
-                        status_text.text(message)
-                    
-                    # 处理文件
-                    result = uploader.process_excel_file(
-                        uploaded_file, 
-                        report_month, 
-                        clear_history=clear_history,
-                        progress_callback=update_progress
-                    )
-                    
-                    # 显示结果
-                    st.subheader("📊 上传结果")
-                    
-                    # 结果统计
-                    col_cleared, col_success, col_failed, col_time = st.columns(4)
-                    with col_cleared:
-                        st.metric("🗑️ 清理历史", result['cleared_count'])
-                    with col_success:
-                        st.metric("✅ 成功上传", result['success_count'])
-                    with col_failed:
-                        st.metric("❌ 失败数量", result['failed_count'])
-                    with col_time:
-                        st.metric("⏱️ 总耗时", f"{result['total_time']:.2f}s")
-                    
-                    # 成功信息
-                    if result['success_count'] > 0:
-                        st.success(f"✅ 成功处理 {result['success_count']} 个门店的数据")
-                        
-                        if result['processed_stores']:
-                            with st.expander("查看成功上传的门店"):
-                                success_df = pd.DataFrame(result['processed_stores'])
-                                st.dataframe(success_df, use_container_width=True)
-                        
-                        # 显示应收未收金额提取调试信息
-                        with st.expander("🔧 应收金额提取调试信息"):
-                            try:
-                                # 获取一个示例报表的调试信息
-                                sample_report = db['reports'].find_one({'report_month': report_month})
-                                if sample_report:
-                                    debug_info = sample_report.get('financial_data', {}).get('other_metrics', {})
-                                    if debug_info:
-                                        for key, value in debug_info.items():
-                                            st.write(f"**{key}:** {value}")
-                                    else:
-                                        st.write("无调试信息")
-                                    
-                                    # 显示表头处理信息
-                                    headers = sample_report.get('table_headers', [])
-                                    st.write("**处理后的表头:**")
-                                    for i, h in enumerate(headers):
-                                        if h == "":
-                                            st.write(f"列 {i}: [空白] (长度: {len(h)})")
-                                        else:
-                                            st.write(f"列 {i}: '{h}' (长度: {len(h)})")
-                                else:
-                                    st.write("未找到报表数据")
-                            except Exception as e:
-                                st.write(f"获取调试信息失败: {e}")
-                    
-                    # 失败信息
-                    if result['failed_count'] > 0:
-                        st.error(f"❌ {result['failed_count']} 个门店上传失败")
-                        
-                        if result['failed_stores']:
-                            with st.expander("查看失败详情"):
-                                failed_df = pd.DataFrame(result['failed_stores'])
-                                st.dataframe(failed_df, use_container_width=True)
-                    
-                    # 错误信息
-                    if result['errors']:
-                        with st.expander("查看错误详情"):
-                            for error in result['errors']:
-                                st.error(error)
-                    
-                    progress_bar.empty()
-                    status_text.empty()
+                    # 提交后台任务，处理过程不占用当前页面
+                    try:
+                        job_id = job_manager.submit(
+                            uploaded_file.getvalue(),
+                            uploaded_file.name,
+                            report_month,
+                            options={
+                                'clear_history': clear_history,
+                                'batch_size': int(batch_size),
+                                'max_workers': int(max_workers),
+                                'streaming': streaming,
+                                'incremental': incremental
+                            }
+                        )
+                        st.success(f"✅ 已提交上传任务 {job_id}，可在下方查看处理进度，也可继续提交其他文件")
+                    except Exception as e:
+                        st.error(f"提交上传任务失败: {e}")
+            
+            st.subheader("📋 上传任务")
+            
+            # 有未完成任务时定时刷新任务列表；旧版Streamlit不支持局部刷新，改为手动刷新
+            fragment = getattr(st, 'fragment', None)
+            if fragment is not None and job_manager.has_active_jobs():
+                fragment(run_every=2)(poll_upload_jobs)(job_manager, db)
+            else:
+                if fragment is None and job_manager.has_active_jobs():
+                    st.button("🔄 刷新任务状态")
+                render_upload_jobs(job_manager, db)
         
         with col2:
             st.subheader("📈 系统统计")
@@ -1288,10 +2917,20 @@ def create_upload_app():
                         st.dataframe(stores_df[['store_name', 'store_code', 'region']], use_container_width=True)
                     else:
                         st.info("暂无门店数据")
+                
+                st.subheader("📑 报表摘要")
+                if st.button("重建报表摘要", help="根据已有报表重新生成查询页使用的报表摘要，用于回填历史数据"):
+                    with st.spinner("正在重建报表摘要..."):
+                        summaries_count = BulkReportUploader(db).rebuild_report_summaries()
+                    st.success(f"已重建 {summaries_count} 条报表摘要")
                         
             except Exception as e:
                 st.error(f"获取统计失败: {e}")
             
+            st.subheader("🩺 连接诊断")
+            with st.expander("查看连接池、命令耗时和索引"):
+                render_connection_diagnostics(db_manager)
+            
             st.markdown("---")
             if st.button("退出管理员登录", type="secondary"):
                 st.session_state.admin_authenticated = False
@@ -1334,6 +2973,22 @@ def create_permission_app():
     try:
         permission_manager = PermissionManager(db)
         
+        # 查询编号重复时未创建唯一索引，列出重复编号由管理员处理
+        permission_conflict = db_manager.index_conflicts.get('permissions')
+        if permission_conflict:
+            st.error(
+                f"❌ 有 {len(permission_conflict['duplicates'])} 个查询编号存在重复记录，查询编号唯一索引未创建。"
+                "请在「权限配置」中删除重复的查询编号后重新上传权限表，再点击下方按钮重新检查"
+            )
+            with st.expander("查看重复的查询编号"):
+                st.dataframe(pd.DataFrame([
+                    {'查询编号': duplicate['key']['query_code'], '记录数': duplicate['count']}
+                    for duplicate in permission_conflict['duplicates']
+                ]), use_container_width=True, hide_index=True)
+            if st.button("重新检查并创建唯一索引", key="perm_recheck_index"):
+                db_manager.ensure_unique_indexes()
+                st.rerun()
+        
         # 标签页
         tab1, tab2 = st.tabs(["📤 上传权限表", "📋 权限配置"])
         
@@ -1357,6 +3012,23 @@ def create_permission_app():
                     st.subheader("文件预览")
                     st.dataframe(preview_df.head(10))
                     
+                    if st.button("🔍 预览变更", help="只比较不写入：列出将新建的门店以及将新建、更新和保持不变的查询编号"):
+                        with st.spinner("正在比较权限表与已有权限..."):
+                            uploaded_file.seek(0)
+                            preview = permission_manager.upload_permission_table(uploaded_file, dry_run=True)
+                        
+                        if preview["success"]:
+                            render_dry_run_diff(preview["diff"], {
+                                "stores_to_create": "🏪 新建门店",
+                                "created": "🆕 新建权限",
+                                "updated": "🔄 更新权限",
+                                "unchanged": "⏸️ 未变化"
+                            })
+                            for error in preview["errors"]:
+                                st.write(f"• {error}")
+                        else:
+                            st.error(f"❌ 预览失败: {preview['message']}")
+                    
                     if st.button("开始上传", type="primary"):
                         with st.spinner("正在处理权限表..."):
                             uploaded_file.seek(0)
@@ -1394,23 +3066,49 @@ def create_permission_app():
         with tab2:
             st.subheader("当前权限配置")
             
-            permissions = permission_manager.get_all_permissions()
+            col_search, col_page_size = st.columns([3, 1])
+            with col_search:
+                search_prefix = st.text_input("按查询编号前缀搜索", key="perm_search_prefix").strip()
+            with col_page_size:
+                page_size = st.selectbox("每页条数", [20, 50, 100, 200], index=1, key="perm_page_size")
             
-            if permissions:
-                for perm in permissions:
-                    with st.expander(f"查询编号: {perm['query_code']} → {perm['store_name']}"):
-                        st.write(f"**门店名称:** {perm['store_name']}")
-                        st.write(f"**门店ID:** {perm['store_id']}")
-                        st.write(f"**门店代码:** {perm.get('store_code', 'N/A')}")
-                        st.write(f"**创建时间:** {perm.get('created_at', 'N/A')}")
-                        st.write(f"**更新时间:** {perm.get('updated_at', 'N/A')}")
-                        
-                        if st.button(f"删除权限", key=f"delete_{perm['query_code']}"):
-                            if permission_manager.delete_permission(perm['query_code']):
-                                st.success("权限配置已删除")
-                                st.rerun()
-                            else:
-                                st.error("删除失败")
+            total_permissions = permission_manager.count_permissions(search_prefix)
+            
+            if total_permissions:
+                page_count = (total_permissions + page_size - 1) // page_size
+                page = st.number_input(
+                    f"页码（共{page_count}页，{total_permissions}条）",
+                    min_value=1,
+                    max_value=page_count,
+                    value=1,
+                    key=f"perm_page_{search_prefix}_{page_size}"
+                )
+                permissions = permission_manager.search_permissions(search_prefix, (int(page) - 1) * page_size, page_size)
+                
+                permissions_df = pd.DataFrame({
+                    '选择': False,
+                    '查询编号': [perm['query_code'] for perm in permissions],
+                    '门店名称': [perm.get('store_name', '') for perm in permissions],
+                    '门店代码': [perm.get('store_code', 'N/A') for perm in permissions],
+                    '门店ID': [perm.get('store_id', '') for perm in permissions],
+                    '创建时间': [perm.get('created_at') for perm in permissions],
+                    '更新时间': [perm.get('updated_at') for perm in permissions]
+                })
+                edited_df = st.data_editor(
+                    permissions_df,
+                    hide_index=True,
+                    use_container_width=True,
+                    disabled=[col for col in permissions_df.columns if col != '选择'],
+                    key=f"perm_editor_{search_prefix}_{page_size}_{int(page)}"
+                )
+                
+                selected_codes = edited_df.loc[edited_df['选择'], '查询编号'].tolist()
+                if st.button(f"🗑️ 删除选中的权限 ({len(selected_codes)})", disabled=not selected_codes, key="perm_bulk_delete"):
+                    deleted_count = permission_manager.delete_permissions(selected_codes)
+                    st.success(f"已删除 {deleted_count} 条权限配置")
+                    st.rerun()
+            elif search_prefix:
+                st.info("没有以该前缀开头的查询编号")
             else:
                 st.info("暂无权限配置")
             
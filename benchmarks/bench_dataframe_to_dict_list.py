@@ -0,0 +1,111 @@
+# bench_dataframe_to_dict_list.py - ReportModel.dataframe_to_dict_list 微基准
+"""
+对比逐行(iterrows)转换与向量化转换的耗时，并校验两者输出完全一致
+
+用法:
+    python benchmarks/bench_dataframe_to_dict_list.py --rows 300 --cols 20 --repeat 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ReportModel  # noqa: E402
+
+
+def legacy_dataframe_to_dict_list(df: pd.DataFrame):
+    """向量化之前的逐行实现，作为输出一致性和耗时的参照"""
+    headers = []
+    for col in df.columns:
+        col_str = str(col)
+        if col_str.startswith('Unnamed:') or col_str.startswith('Unnamed ') or ('unnamed' in col_str.lower()):
+            headers.append("")
+        else:
+            headers.append(col_str)
+
+    result = []
+    for index, row in df.iterrows():
+        row_dict = {}
+        for col_idx, value in enumerate(row):
+            col_key = f"col_{col_idx}"
+            if pd.isna(value):
+                row_dict[col_key] = ""
+            elif isinstance(value, (int, float)):
+                row_dict[col_key] = float(value) if not pd.isna(value) else 0.0
+            else:
+                value_str = str(value).strip()
+                if value_str.startswith('='):
+                    if '平台内支出' in value_str:
+                        row_dict[col_key] = "--平台内支出"
+                    elif value_str.startswith('=--'):
+                        row_dict[col_key] = value_str[3:]
+                    else:
+                        row_dict[col_key] = value_str[1:]
+                else:
+                    row_dict[col_key] = value_str
+        result.append(row_dict)
+
+    return result, headers
+
+
+def make_sheet(rows: int, cols: int, seed: int = 0) -> pd.DataFrame:
+    """生成与门店报表显示数据相似的工作表：首列为指标名称，其余为数字/文本/公式/空值混合列"""
+    rng = np.random.default_rng(seed)
+    data = {'项目': [f"指标{i}" if i % 7 else "=--平台内支出" for i in range(rows)]}
+    for col in range(1, cols):
+        numbers = np.round(rng.uniform(-1e5, 1e5, rows), 2)
+        if col % 3 == 0:
+            # 纯数字列（含空值）
+            values = np.where(rng.random(rows) < 0.2, np.nan, numbers)
+        else:
+            # 数字、文本、公式和空值混合列
+            values = numbers.astype(object)
+            choice = rng.random(rows)
+            values[choice < 0.15] = None
+            values[(choice >= 0.15) & (choice < 0.25)] = " 备注 "
+            values[(choice >= 0.25) & (choice < 0.3)] = "=--线上支出"
+        data[f"Unnamed: {col}" if col % 4 == 0 else f"列{col}"] = values
+    return pd.DataFrame(data)
+
+
+def best_time(func, df: pd.DataFrame, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        sheet = df.copy()
+        start = time.perf_counter()
+        func(sheet)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=300)
+    parser.add_argument('--cols', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    df = make_sheet(args.rows, args.cols)
+
+    legacy_result = legacy_dataframe_to_dict_list(df.copy())
+    vectorized_result = ReportModel.dataframe_to_dict_list(df.copy())
+    if repr(legacy_result) != repr(vectorized_result):
+        raise SystemExit("输出不一致：向量化实现与逐行实现结果不同")
+
+    legacy_time = best_time(legacy_dataframe_to_dict_list, df, args.repeat)
+    vectorized_time = best_time(ReportModel.dataframe_to_dict_list, df, args.repeat)
+
+    print(f"工作表: {args.rows} 行 x {args.cols} 列，重复 {args.repeat} 次取最快")
+    print(f"逐行实现:   {legacy_time * 1000:8.2f} ms")
+    print(f"向量化实现: {vectorized_time * 1000:8.2f} ms")
+    print(f"加速比:     {legacy_time / vectorized_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
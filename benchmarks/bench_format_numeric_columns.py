@@ -0,0 +1,78 @@
+# bench_format_numeric_columns.py - 报表显示数字格式化微基准
+"""
+对比逐值格式化与整列向量化格式化(format_numeric_columns)的耗时，并校验两者输出完全一致
+
+用法:
+    python benchmarks/bench_format_numeric_columns.py --rows 1000 --cols 20 --repeat 20
+"""
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from app import ReportModel, format_numeric_columns, rebuild_dataframe_with_headers  # noqa: E402
+from bench_dataframe_to_dict_list import best_time, make_sheet  # noqa: E402
+
+
+def legacy_format_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """向量化之前的逐值实现，作为输出一致性和耗时的参照"""
+    display_df = df.copy()
+
+    for col in df.columns:
+        try:
+            numeric_series = pd.to_numeric(df[col], errors='coerce')
+            if numeric_series.notna().sum() > len(df) * 0.3:
+                formatted_values = []
+                for i, val in enumerate(df[col]):
+                    try:
+                        num_val = pd.to_numeric(val, errors='coerce')
+                        if pd.notna(num_val):
+                            formatted_values.append(f"{num_val:,.2f}")
+                        else:
+                            formatted_values.append(str(val) if pd.notna(val) else "")
+                    except:
+                        formatted_values.append(str(val) if pd.notna(val) else "")
+                display_df[col] = formatted_values
+        except:
+            continue
+
+    return display_df
+
+
+def make_report(rows: int, cols: int, seed: int = 0) -> pd.DataFrame:
+    """按上传和查询链路生成查询页上的报表DataFrame：转换为逐行字典、列式编码后再重建"""
+    excel_data, headers = ReportModel.dataframe_to_dict_list(make_sheet(rows, cols, seed))
+    return rebuild_dataframe_with_headers(ReportModel.encode_columnar(excel_data, len(headers)), headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--cols', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    df = make_report(args.rows, args.cols)
+
+    legacy_result = legacy_format_numeric_columns(df)
+    vectorized_result = format_numeric_columns(df)
+    if not legacy_result.equals(vectorized_result) or list(legacy_result.dtypes) != list(vectorized_result.dtypes):
+        raise SystemExit("输出不一致：向量化实现与逐值实现结果不同")
+
+    legacy_time = best_time(legacy_format_numeric_columns, df, args.repeat)
+    vectorized_time = best_time(format_numeric_columns, df, args.repeat)
+
+    print(f"报表: {args.rows} 行 x {args.cols} 列，重复 {args.repeat} 次取最快")
+    print(f"逐值实现:   {legacy_time * 1000:8.2f} ms")
+    print(f"向量化实现: {vectorized_time * 1000:8.2f} ms")
+    print(f"加速比:     {legacy_time / vectorized_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
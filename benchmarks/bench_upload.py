@@ -0,0 +1,188 @@
+# bench_upload.py - 批量上传链路分阶段基准
+"""
+用合成工作簿对BulkReportUploader.process_excel_file计时，按阶段输出耗时：
+解析Excel、构建DataFrame、dataframe_to_dict_list、extract_financial_data、
+内容指纹、门店匹配、构建报表文档和数据库写入，结果以JSON保存便于跨提交对比
+
+默认使用进程内的mongomock；指定--mongo-uri时连接本地mongod（使用独立的基准数据库，运行前清空）。
+为避免误删业务数据，数据库名称必须以bench_开头，否则需要显式指定--force
+
+用法:
+    python benchmarks/bench_upload.py --sheets 100 --rows 60 --cols 12 --repeat 3 --output bench.json
+    python benchmarks/bench_upload.py --mongo-uri mongodb://localhost:27017/ --database bench_store_reports
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from app import BulkReportUploader  # noqa: E402
+from generate_workbook import generate_workbook  # noqa: E402
+
+try:
+    import inspect
+    import mongomock
+    import mongomock.collection
+    MONGOMOCK_AVAILABLE = True
+except ImportError:
+    MONGOMOCK_AVAILABLE = False
+
+
+def patch_mongomock_bulk_sort():
+    """pymongo 4.11起ReplaceOne/UpdateOne向批量写入传递sort参数，旧版mongomock不接受该参数
+
+    基准中的写入操作不使用sort，未传递sort时忽略该参数即可
+    """
+    builder = mongomock.collection.BulkOperationBuilder
+    for method_name in ('add_replace', 'add_update'):
+        method = getattr(builder, method_name)
+        if 'sort' in inspect.signature(method).parameters:
+            continue
+
+        def accept_sort(self, *args, _method=method, sort=None, **kwargs):
+            if sort:
+                raise NotImplementedError('mongomock不支持批量写入中的sort参数')
+            return _method(self, *args, **kwargs)
+
+        setattr(builder, method_name, accept_sort)
+
+
+BENCH_DATABASE_PREFIX = 'bench_'
+
+
+def get_database(mongo_uri: str, database_name: str, force: bool = False):
+    """获取基准数据库并清空上次运行留下的数据；非bench_前缀的数据库需要force=True才会清空"""
+    if mongo_uri:
+        if not database_name.startswith(BENCH_DATABASE_PREFIX) and not force:
+            raise SystemExit(
+                f"拒绝清空数据库 {database_name}：基准数据库名称须以 {BENCH_DATABASE_PREFIX} 开头，"
+                f"确认要清空时请指定 --force"
+            )
+        from pymongo import MongoClient, uri_parser
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        hosts = ', '.join(f"{host}:{port}" for host, port in uri_parser.parse_uri(mongo_uri)['nodelist'])
+        print(f"清空基准数据库: {database_name} @ {hosts}", file=sys.stderr)
+        client.drop_database(database_name)
+        return client[database_name]
+
+    if not MONGOMOCK_AVAILABLE:
+        raise SystemExit("未安装mongomock，请执行 pip install mongomock 或通过 --mongo-uri 指定本地mongod")
+    patch_mongomock_bulk_sort()
+    return mongomock.MongoClient()[database_name]
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def run_once(db, workbook_bytes: bytes, report_month: str, options: dict) -> dict:
+    """执行一次完整上传，返回总耗时和分阶段耗时"""
+    uploader = BulkReportUploader(db)
+    result = uploader.process_excel_file(io.BytesIO(workbook_bytes), report_month, **options)
+    if result['errors']:
+        raise SystemExit(f"上传出错: {result['errors'][:3]}")
+    return {
+        'total_time': result['total_time'],
+        'success_count': result['success_count'],
+        'failed_count': result['failed_count'],
+        'timings': result['timings']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=60)
+    parser.add_argument('--cols', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workbook', help='使用已有工作簿代替合成工作簿')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--report-month', default='2024-12')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--max-workers', type=int, default=1)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--mongo-uri', help='本地mongod连接字符串，不指定时使用mongomock')
+    parser.add_argument('--database', default='bench_store_reports', help='基准数据库名称，运行前会被清空，须以bench_开头')
+    parser.add_argument('--force', action='store_true', help='允许清空不以bench_开头的数据库')
+    parser.add_argument('--output', help='JSON结果文件路径，不指定时输出到标准输出')
+    args = parser.parse_args()
+
+    if args.workbook:
+        with open(args.workbook, 'rb') as f:
+            workbook_bytes = f.read()
+    else:
+        workbook_bytes = generate_workbook(args.sheets, args.rows, args.cols, args.seed)
+
+    options = {
+        'batch_size': args.batch_size,
+        'max_workers': args.max_workers,
+        'streaming': args.streaming,
+        'incremental': args.incremental
+    }
+
+    db = get_database(args.mongo_uri, args.database, args.force)
+    runs = [run_once(db, workbook_bytes, args.report_month, options) for _ in range(args.repeat)]
+
+    # 各阶段取多次运行中的最小值，减少偶发抖动的影响
+    best = {
+        'total_time': min(run['total_time'] for run in runs),
+        'timings': {stage: min(run['timings'][stage] for run in runs) for stage in runs[0]['timings']}
+    }
+
+    report = {
+        'benchmark': 'bulk_upload',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'database': 'mongod' if args.mongo_uri else 'mongomock'
+        },
+        'workbook': {
+            'source': args.workbook or 'synthetic',
+            'sheets': args.sheets,
+            'rows': args.rows,
+            'cols': args.cols,
+            'seed': args.seed,
+            'size_bytes': len(workbook_bytes)
+        },
+        'options': options,
+        'best': best,
+        'runs': runs
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"结果已写入 {args.output}")
+    else:
+        print(output)
+
+    print(f"\n总耗时(最快): {best['total_time']:.3f}s", file=sys.stderr)
+    for stage, elapsed in best['timings'].items():
+        print(f"  {stage:<24}{elapsed:8.3f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# generate_workbook.py - 按门店报表模板生成合成工作簿
+"""
+生成与真实门店报表模板结构一致的工作簿：每个工作表对应一个门店，
+第2行为显示表头，第4行为财务表头（含两个合计列），
+财务数据第37行（工作表第41行）第2个合计列为总部应收未收金额，
+部分项目名称为"=--平台内支出"这类以文本保存的公式（真实模板中显示为#NAME?）
+
+用法:
+    python benchmarks/generate_workbook.py --sheets 50 --rows 60 --cols 12 --output synthetic.xlsx
+"""
+
+import argparse
+import io
+
+import numpy as np
+from openpyxl import Workbook
+
+# 财务表头第37行数据（表头在第4行，索引36）
+RECEIVABLE_ROW_INDEX = 36
+# 以文本保存的公式项目名称，覆盖sheet_conversion中的公式前缀修复
+FORMULA_TEXT_NAME = '=--平台内支出'
+
+METRIC_NAMES = [
+    '营业收入', '线上收入', '线下收入', '收入合计',
+    '商品成本', '房租', '人工费用', '水电费', '物业费', '线上支出', '成本合计',
+    '毛利润', '净利润', '线上净利润',
+]
+
+
+def _metric_name(row_index: int) -> str:
+    if row_index == RECEIVABLE_ROW_INDEX:
+        return '总部应收未收金额'
+    if row_index % 11 == 10:
+        return FORMULA_TEXT_NAME
+    return f"{METRIC_NAMES[row_index % len(METRIC_NAMES)]}{row_index // len(METRIC_NAMES) or ''}"
+
+
+def fill_sheet(ws, store_name: str, rows: int, cols: int, rng: np.random.Generator):
+    """按模板布局填充单个门店工作表，rows为第4行表头之后的数据行数，cols为总列数"""
+    cols = max(cols, 6)
+    rows = max(rows, RECEIVABLE_ROW_INDEX + 1)
+
+    # 第1行：标题
+    ws.append([f"{store_name} 财务报表"] + [None] * (cols - 1))
+
+    # 第2行：显示表头
+    ws.append(['项目'] + [f"{month}月" for month in range(1, cols - 1)] + ['合计'])
+
+    # 第3行：说明行
+    ws.append(['单位：元'] + [None] * (cols - 1))
+
+    # 第4行：财务表头，包含两个合计列
+    middle = [f"明细{index}" for index in range(1, cols - 3)]
+    ws.append(['项目', '合计', '备注'] + middle[:cols - 4] + ['合计'])
+    second_total_col = cols - 1
+
+    amounts = np.round(rng.uniform(-1e5, 1e5, size=(rows, cols)), 2)
+    blanks = rng.random(size=(rows, cols)) < 0.15
+    for row_index in range(rows):
+        values = [_metric_name(row_index)]
+        for col_index in range(1, cols):
+            if col_index == 2:
+                values.append('已核对' if row_index % 5 == 0 else None)
+            elif blanks[row_index, col_index] and row_index != RECEIVABLE_ROW_INDEX:
+                values.append(None)
+            else:
+                values.append(float(amounts[row_index, col_index]))
+        if row_index == RECEIVABLE_ROW_INDEX:
+            values[second_total_col] = float(amounts[row_index, second_total_col])
+        ws.append(values)
+        if values[0] == FORMULA_TEXT_NAME:
+            # openpyxl会把以"="开头的字符串写成公式，data_only读取时公式单元格为None；
+            # 显式写为文本单元格，读取时才能得到公式文本
+            ws.cell(row=ws.max_row, column=1).data_type = 's'
+
+
+def generate_workbook(sheets: int = 20, rows: int = 60, cols: int = 12, seed: int = 0) -> bytes:
+    """生成包含sheets个门店工作表的工作簿，返回xlsx文件内容"""
+    rng = np.random.default_rng(seed)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for index in range(sheets):
+        store_name = f"犀牛百货测试{index + 1:04d}店"
+        fill_sheet(wb.create_sheet(store_name[:31]), store_name, rows, cols, rng)
+
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=20, help='门店工作表数量')
+    parser.add_argument('--rows', type=int, default=60, help='第4行表头之后的数据行数（至少37）')
+    parser.add_argument('--cols', type=int, default=12, help='列数（至少6）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='synthetic_workbook.xlsx')
+    args = parser.parse_args()
+
+    with open(args.output, 'wb') as f:
+        f.write(generate_workbook(args.sheets, args.rows, args.cols, args.seed))
+    print(f"已生成 {args.output}: {args.sheets} 个工作表, {args.rows} 行 x {args.cols} 列")
+
+
+if __name__ == '__main__':
+    main()
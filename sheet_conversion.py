@@ -0,0 +1,315 @@
+# sheet_conversion.py - 门店报表工作表转换
+"""
+将工作表单元格网格转换为报表显示数据、财务数据和内容指纹的纯计算函数
+
+本模块不依赖Streamlit和数据库连接，批量上传并行转换时由forkserver/spawn方式启动的子进程导入执行，
+子进程不会继承主进程的线程、锁和数据库连接。
+"""
+
+import hashlib
+import json
+import re
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# 合计列关键词
+TOTAL_COLUMN_KEYWORDS = [
+    '合计', 'total', '总计', '小计', 'sum', '汇总',
+    '金额', '总金额', '合计金额', '小计金额',
+    '总额', '总和', '累计', '统计'
+]
+
+
+# 指标分类匹配器：按收入、成本、利润的优先级判断指标名称所属类别，匹配到的分组名即类别
+METRIC_CATEGORY_PATTERN = re.compile(
+    r'^(?:(?=.*?(?:收入|营收|销售额|营业收入))(?P<revenue>)'
+    r'|(?=.*?(?:成本|费用|支出))(?P<cost>)'
+    r'|(?=.*?(?:利润|盈利|净利|毛利))(?P<profit>))',
+    re.DOTALL
+)
+
+
+def to_numeric_matrix(df: pd.DataFrame) -> np.ndarray:
+    """将整个表格一次性转换为float矩阵，无法转换为数字的单元格（含日期时间）为NaN"""
+    cells = pd.Series(df.to_numpy(dtype=object).ravel(), dtype=object)
+    numeric = pd.to_numeric(cells, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return numeric.reshape(df.shape)
+
+
+def _first_valid_values(matrix: np.ndarray, col_indices: List[int]) -> np.ndarray:
+    """按给定列顺序取每行第一个非空数值，整行都为空时为NaN"""
+    if not col_indices:
+        return np.full(matrix.shape[0], np.nan)
+    block = matrix[:, col_indices]
+    valid = ~np.isnan(block)
+    first_valid = block[np.arange(block.shape[0]), valid.argmax(axis=1)]
+    return np.where(valid.any(axis=1), first_valid, np.nan)
+
+
+def grid_to_dataframe(grid: List[List[Any]], header: int) -> pd.DataFrame:
+    """以指定行为表头从单元格网格构建DataFrame，类型推断与pd.read_excel一致"""
+    if not grid:
+        return pd.DataFrame()
+    try:
+        return TextParser(grid, header=header, skip_blank_lines=False).read()
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def _convert_cells(df: pd.DataFrame) -> np.ndarray:
+    """转换全部单元格：空值为空字符串，数字转为float，文本去除首尾空白并修复#NAME?错误（公式前缀）
+
+    整个表格先转为对象数组，再一次性做空值、数字和文本处理，返回按行排列的二维对象数组。
+    """
+    n_rows, n_cols = df.shape
+    cells = df.to_numpy(dtype=object).ravel()
+
+    # 按单元格类型区分数字（含bool等int/float子类）与文本
+    cell_types = pd.Series(np.fromiter(map(type, cells), dtype=object, count=len(cells)))
+    number_types = [cell_type for cell_type in cell_types.unique() if issubclass(cell_type, (int, float))]
+    na_mask = pd.isna(cells)
+    number_mask = cell_types.isin(number_types).to_numpy() & ~na_mask
+    text_mask = ~(na_mask | number_mask)
+
+    converted = np.empty(len(cells), dtype=object)
+    converted[na_mask] = ""
+    if number_mask.any():
+        converted[number_mask] = np.asarray(cells[number_mask].tolist(), dtype=float)
+    if text_mask.any():
+        text = pd.Series(cells[text_mask], dtype=object).astype(str).str.strip()
+        # 处理Excel公式，特别是"=--平台内支出"这类
+        is_formula = text.str.startswith('=').to_numpy(dtype=bool)
+        if is_formula.any():
+            formulas = text[is_formula]
+            text[is_formula] = np.select(
+                [
+                    formulas.str.contains('平台内支出', regex=False).to_numpy(dtype=bool),
+                    formulas.str.startswith('=--').to_numpy(dtype=bool)
+                ],
+                ["--平台内支出", formulas.str[3:].to_numpy(dtype=object)],
+                default=formulas.str[1:].to_numpy(dtype=object)
+            )
+        converted[text_mask] = text.to_numpy(dtype=object)
+
+    return converted.reshape(n_rows, n_cols)
+
+
+def dataframe_to_dict_list(df: pd.DataFrame) -> tuple[List[Dict], List[str]]:
+    """将DataFrame转换为字典列表，保留表头信息并修复#NAME?错误，处理空白表头"""
+    # 保存原始列名作为表头，处理Unnamed列，避免重复空白列名
+    headers = []
+    empty_count = 0
+    for col in df.columns:
+        col_str = str(col)
+        # 将Unnamed列名替换为空字符串
+        if col_str.startswith('Unnamed:') or col_str.startswith('Unnamed ') or ('unnamed' in col_str.lower()):
+            headers.append("")
+        else:
+            headers.append(col_str)
+
+    # 处理重复的空白列名，为pandas创建唯一列名
+    unique_headers = []
+    empty_count = 0
+    for header in headers:
+        if header == "":
+            unique_headers.append(f"_empty_{empty_count}")
+            empty_count += 1
+        else:
+            unique_headers.append(header)
+
+    # 使用唯一列名重建DataFrame，但保存原始表头用于显示
+    df.columns = unique_headers
+
+    # 整表向量化转换单元格，再按行组装字典
+    if df.shape[1] == 0:
+        return [{} for _ in range(len(df))], headers
+
+    col_keys = [f"col_{col_idx}" for col_idx in range(df.shape[1])]
+    result = [dict(zip(col_keys, row_values)) for row_values in _convert_cells(df).tolist()]
+
+    return result, headers
+
+
+def compute_content_hash(excel_data: List[Dict], headers: List[str], financial_data: Dict) -> str:
+    """计算工作表内容指纹，内容不变时重复上传可跳过写入"""
+    payload = json.dumps(
+        {'headers': headers, 'rows': excel_data, 'financial_data': financial_data},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def extract_financial_data(df: pd.DataFrame) -> Dict:
+    """改进的财务数据提取 - 第4行为表头，查找合计列，从第37行提取总部应收未收金额"""
+    financial_data = {
+        'revenue': {},
+        'cost': {},
+        'profit': {},
+        'receivables': {},
+        'other_metrics': {}
+    }
+
+    try:
+        # 整表一次性转换为数值矩阵，后续合计列识别和指标取值均基于该矩阵
+        numeric_matrix = to_numeric_matrix(df)
+
+        # 1. 查找合计列
+        total_col_indices = []
+
+        for col_idx, col_name in enumerate(df.columns):
+            col_str = str(col_name).lower().strip()
+            if any(keyword in col_str for keyword in TOTAL_COLUMN_KEYWORDS):
+                total_col_indices.append(col_idx)
+
+        # 如果没有找到合计列，按数值含量智能识别
+        if not total_col_indices:
+            numeric_counts = (~np.isnan(numeric_matrix)).sum(axis=0)
+
+            # 按数字含量排序（数量相同时保持列顺序），取前2个作为合计列
+            if len(numeric_counts) >= 2:
+                total_col_indices = [int(col_idx) for col_idx in np.argsort(-numeric_counts, kind='stable')[:2]]
+
+        # 调试信息：记录列识别结果
+        financial_data['other_metrics']['所有列名'] = [str(col) for col in df.columns]
+        financial_data['other_metrics']['合计列位置'] = str(total_col_indices)
+        financial_data['other_metrics']['合计列数量'] = len(total_col_indices)
+        if total_col_indices:
+            financial_data['other_metrics']['合计列名称'] = [str(df.columns[i]) for i in total_col_indices]
+
+        # 2. 直接从第37行第2个合计列提取总部应收未收金额
+        if len(df) >= 37 and len(total_col_indices) >= 2:
+            target_row_index = 36  # 第37行（索引36，因为第4行为表头）
+            target_col_idx = total_col_indices[1]  # 使用第二个合计列
+            column_desc = f"第{target_col_idx+1}列(第2个合计列)"
+
+            try:
+                # 直接提取第37行第2个合计列的值
+                raw_value = df.iloc[target_row_index, target_col_idx]
+                financial_data['other_metrics']['第37行第2合计列原值'] = str(raw_value)
+                financial_data['other_metrics']['使用列索引'] = target_col_idx
+                financial_data['other_metrics']['使用列描述'] = column_desc
+
+                parsed_value = pd.to_numeric(raw_value, errors='coerce')
+                if not pd.isna(parsed_value):
+                    # 保存原始数值
+                    financial_data['receivables']['net_amount'] = float(parsed_value)
+                    financial_data['other_metrics']['总部应收未收金额'] = float(parsed_value)
+
+                    # 格式化为两位小数和千分位
+                    formatted_value = f"{parsed_value:,.2f}"
+                    financial_data['other_metrics']['格式化金额'] = formatted_value
+
+                    financial_data['other_metrics']['提取位置'] = f"第37行{column_desc}"
+                    financial_data['other_metrics']['提取成功'] = True
+                    financial_data['other_metrics']['数值处理'] = f"原始值: {parsed_value}, 格式化: {formatted_value}"
+                else:
+                    financial_data['other_metrics']['提取失败原因'] = "数值转换失败"
+
+            except (ValueError, TypeError, IndexError) as e:
+                financial_data['other_metrics']['提取失败原因'] = f"异常: {str(e)}"
+
+        else:
+            if len(df) < 37:
+                financial_data['other_metrics']['提取失败原因'] = f"数据行数不足37行，实际{len(df)}行"
+            elif len(total_col_indices) < 2:
+                financial_data['other_metrics']['提取失败原因'] = f"合计列数不足2列，实际{len(total_col_indices)}列"
+
+        # 3. 提取其他财务指标
+        if len(df.columns) < 2:
+            return financial_data
+
+        # 指标名称取自df.values（整表公共类型），与逐行读取时的取值一致
+        first_column = pd.Series(df.values[:, 0], dtype=object)
+        metric_names = first_column.where(first_column.notna(), "").astype(str).str.strip()
+
+        # 查找数值（优先从合计列取值，合计列没有值时从其他列查找）
+        other_col_indices = [col_idx for col_idx in range(1, len(df.columns)) if col_idx not in total_col_indices]
+        values = _first_valid_values(numeric_matrix, total_col_indices)
+        values = np.where(np.isnan(values), _first_valid_values(numeric_matrix, other_col_indices), values)
+
+        for idx, metric_name, value in zip(df.index, metric_names.tolist(), values.tolist()):
+            if not metric_name:
+                continue
+
+            if np.isnan(value):
+                value = 0
+
+            # 4. 分类存储财务指标
+            category_match = METRIC_CATEGORY_PATTERN.match(metric_name)
+            category = category_match.lastgroup if category_match else None
+
+            if category == 'revenue':
+                if '线上' in metric_name:
+                    financial_data['revenue']['online_revenue'] = value
+                elif '线下' in metric_name:
+                    financial_data['revenue']['offline_revenue'] = value
+                elif '总' in metric_name or '合计' in metric_name:
+                    financial_data['revenue']['total_revenue'] = value
+
+            elif category == 'cost':
+                if '商品' in metric_name:
+                    financial_data['cost']['product_cost'] = value
+                elif '租金' in metric_name or '房租' in metric_name:
+                    financial_data['cost']['rent_cost'] = value
+                elif '人工' in metric_name or '工资' in metric_name:
+                    financial_data['cost']['labor_cost'] = value
+
+            elif category == 'profit':
+                if '毛利' in metric_name:
+                    financial_data['profit']['gross_profit'] = value
+                elif '净利' in metric_name:
+                    financial_data['profit']['net_profit'] = value
+
+            # 保存所有指标到other_metrics用于调试
+            if value != 0:
+                financial_data['other_metrics'][f"第{idx+1}行_{metric_name}"] = value
+
+    except Exception as e:
+        # 子进程中无法显示页面提示，异常信息随调试信息保存
+        financial_data['other_metrics']['提取异常'] = f"提取财务数据时出错: {e}"
+
+    return financial_data
+
+
+def convert_sheet(grid: List[List[Any]]) -> Dict:
+    """转换单个工作表的显示数据并提取财务数据，纯计算，可在子进程中执行"""
+    timings = {}
+
+    # 处理显示数据 - 使用第2行为表头
+    stage_start = time.time()
+    df_display_cleaned = grid_to_dataframe(grid, header=1).dropna(axis=1, how='all')
+    if df_display_cleaned.empty:
+        timings['build_dataframes'] = time.time() - stage_start
+        return {'empty': True, 'timings': timings}
+
+    # 处理财务数据 - 使用第4行为表头
+    df_financial_cleaned = grid_to_dataframe(grid, header=3).dropna(axis=1, how='all')
+    timings['build_dataframes'] = time.time() - stage_start
+
+    # 转换显示数据格式，保存表头
+    stage_start = time.time()
+    excel_data, headers = dataframe_to_dict_list(df_display_cleaned)
+    timings['dataframe_to_dict_list'] = time.time() - stage_start
+
+    stage_start = time.time()
+    financial_data = extract_financial_data(df_financial_cleaned)
+    timings['extract_financial_data'] = time.time() - stage_start
+
+    stage_start = time.time()
+    content_hash = compute_content_hash(excel_data, headers, financial_data)
+    timings['content_hash'] = time.time() - stage_start
+
+    return {
+        'empty': False,
+        'timings': timings,
+        'excel_data': excel_data,
+        'headers': headers,
+        'financial_data': financial_data,
+        'content_hash': content_hash
+    }
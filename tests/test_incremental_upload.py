@@ -0,0 +1,67 @@
+# test_incremental_upload.py - 增量上传删除已移除门店报表的行为
+import io
+
+import pytest
+
+mongomock = pytest.importorskip('mongomock')
+
+import app  # noqa: E402
+import sheet_conversion  # noqa: E402
+from generate_workbook import generate_workbook  # noqa: E402
+
+REPORT_MONTH = '2024-12'
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['test_store_reports']
+
+
+@pytest.fixture
+def failing_second_sheet(monkeypatch):
+    """让第2个门店的工作表在之后的上传中转换失败"""
+    convert_sheet = sheet_conversion.convert_sheet
+
+    def failing_convert_sheet(grid):
+        if '测试0002店' in str(grid[0][0]):
+            raise ValueError('工作表数据不完整')
+        return convert_sheet(grid)
+
+    return lambda: monkeypatch.setattr(sheet_conversion, 'convert_sheet', failing_convert_sheet)
+
+
+def upload(db, workbook_bytes: bytes, **options) -> dict:
+    return app.BulkReportUploader(db).process_excel_file(io.BytesIO(workbook_bytes), REPORT_MONTH, **options)
+
+
+def test_failed_sheet_keeps_existing_report(db, failing_second_sheet):
+    workbook_bytes = generate_workbook(3)
+    upload(db, workbook_bytes)
+    report_ids = {report['_id'] for report in db['reports'].find()}
+
+    failing_second_sheet()
+    result = upload(db, workbook_bytes, incremental=True)
+
+    assert [failed['store_name'] for failed in result['failed_stores']] == ['犀牛百货测试0002店']
+    assert result['removed_count'] == 0
+    assert {report['_id'] for report in db['reports'].find()} == report_ids
+
+
+def test_failed_sheet_skips_removal_of_missing_stores(db, failing_second_sheet):
+    upload(db, generate_workbook(3))
+
+    failing_second_sheet()
+    # 文件中只有前2个门店，第3个门店本应被删除，但有工作表失败时不删除
+    result = upload(db, generate_workbook(2), incremental=True)
+
+    assert result['removed_count'] == 0
+    assert "1 个工作表处理或写入失败，未删除文件中已不存在的门店报表" in result['errors']
+    assert db['reports'].count_documents({'report_month': REPORT_MONTH}) == 3
+
+
+def test_missing_store_removed_when_all_sheets_succeed(db):
+    upload(db, generate_workbook(3))
+    result = upload(db, generate_workbook(2), incremental=True)
+
+    assert result['removed_count'] == 1
+    assert db['reports'].count_documents({'report_month': REPORT_MONTH}) == 2